@@ -0,0 +1,262 @@
+"""Database snapshots, per-guild JSON exports and incremental backup chains.
+
+Everything here is blocking sqlite3/file code and is meant to run in worker
+threads. A snapshot is taken with SQLite's online backup API, which copies the
+live database a few pages at a time, so the bot keeps writing while it runs.
+Exports then read from that snapshot instead of the live database.
+
+Backups are kept as chains under BackUps/chains/<timestamp>/: a compressed base
+snapshot, then hourly NDJSON files holding only the rows recorded in change_log
+since the previous file, all listed in manifest.json. Restoring replays the
+incrementals onto the base in order.
+"""
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+try:
+    import zstandard
+except ImportError: # gzip is always available; zstd is used when installed
+    zstandard = None
+
+import config
+import database
+
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+CHAINS_DIRNAME = "chains"
+BASE_FILENAME = "base.db.gz"
+MANIFEST_FILENAME = "manifest.json"
+
+# Per-guild tables exported alongside guild_settings. Ordered so that big tables
+# are streamed row by row rather than loaded at once.
+GUILD_EXPORT_QUERIES = {
+    "warnings": "SELECT * FROM warnings WHERE guild_id = ? ORDER BY warning_id",
+    "reaction_roles": "SELECT * FROM reaction_roles WHERE guild_id = ? ORDER BY message_id, emoji",
+    "rank_rewards": "SELECT * FROM rank_rewards WHERE guild_id = ? ORDER BY rank_level",
+    "permission_roles": "SELECT * FROM guild_permission_roles WHERE guild_id = ? ORDER BY level, role_id",
+    "bad_words": "SELECT * FROM bad_words WHERE guild_id = ? ORDER BY word_id",
+    "user_custom_roles": "SELECT * FROM user_custom_roles WHERE guild_id = ? ORDER BY user_id",
+    "music_submissions": "SELECT * FROM music_submissions WHERE guild_id = ? ORDER BY submission_id",
+    "koth_leaderboard": "SELECT * FROM koth_leaderboard WHERE guild_id = ? ORDER BY points DESC, user_id",
+    "ranking_leaderboard": "SELECT * FROM ranking WHERE guild_id = ? ORDER BY xp DESC, user_id",
+}
+
+def snapshot_database(source_path: str, dest_path: str) -> int:
+    """Copies the live database to `dest_path` in a single backup step. A stepped copy
+    from a second connection restarts whenever the bot commits, so under steady writes
+    it may never finish; one step reads a consistent WAL snapshot while the bot keeps
+    writing. Returns the number of pages copied."""
+    pages_copied = 0
+    def progress(status, remaining, total):
+        nonlocal pages_copied
+        pages_copied = total - remaining
+
+    source = sqlite3.connect(source_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest, pages=-1, progress=progress)
+    finally:
+        dest.close()
+        source.close()
+    return pages_copied
+
+def _rows(conn: sqlite3.Connection, sql: str, params: tuple):
+    cursor = conn.execute(sql, params)
+    columns = [description[0] for description in cursor.description]
+    for row in cursor:
+        yield dict(zip(columns, row))
+
+def export_guild(snapshot_path: str, guild_id: int, file_path: str) -> int:
+    """Streams one guild's data from a snapshot into a JSON file, one row at a time.
+    Returns the number of rows written."""
+    conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    rows_written = 0
+    try:
+        settings = next(_rows(conn, "SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,)), {})
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write('{\n    "guild_settings": ')
+            f.write(json.dumps(settings, ensure_ascii=False, default=str))
+            for key, sql in GUILD_EXPORT_QUERIES.items():
+                f.write(f',\n    "{key}": [')
+                for i, row in enumerate(_rows(conn, sql, (guild_id,))):
+                    f.write(',\n        ' if i else '\n        ')
+                    f.write(json.dumps(row, ensure_ascii=False, default=str))
+                    rows_written += 1
+                f.write('\n    ]')
+            f.write('\n}\n')
+    finally:
+        conn.close()
+    return rows_written
+
+# --- Incremental chains ---
+def _open_text(path: str, mode: str):
+    """Opens a compressed NDJSON file for text reading ('r') or writing ('w')."""
+    if path.endswith(".zst"):
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return gzip.open(path, f"{mode}t", encoding="utf-8")
+
+def list_chains(backup_dir: str) -> list[str]:
+    """Returns chain names (their base timestamps), oldest first."""
+    chains_dir = os.path.join(backup_dir, CHAINS_DIRNAME)
+    if not os.path.isdir(chains_dir):
+        return []
+    return sorted(name for name in os.listdir(chains_dir) if os.path.isfile(os.path.join(chains_dir, name, MANIFEST_FILENAME)))
+
+def chain_path(backup_dir: str, name: str) -> str:
+    return os.path.join(backup_dir, CHAINS_DIRNAME, name)
+
+def load_manifest(chain_dir: str) -> dict:
+    with open(os.path.join(chain_dir, MANIFEST_FILENAME), encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_manifest(chain_dir: str, manifest: dict):
+    tmp_path = os.path.join(chain_dir, MANIFEST_FILENAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, os.path.join(chain_dir, MANIFEST_FILENAME))
+
+def start_chain(chain_dir: str, snapshot_path: str) -> int:
+    """Compresses a fresh snapshot into the chain's base and writes its manifest.
+    Returns the last change_id the base already contains."""
+    conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    try:
+        base_change_id = conn.execute("SELECT COALESCE(MAX(change_id), 0) FROM change_log").fetchone()[0]
+    finally:
+        conn.close()
+    with open(snapshot_path, "rb") as src, gzip.open(os.path.join(chain_dir, BASE_FILENAME), "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(snapshot_path)
+    _write_manifest(chain_dir, {
+        "created_at": os.path.basename(chain_dir),
+        "base": BASE_FILENAME,
+        "base_change_id": base_change_id,
+        "incrementals": [],
+    })
+    return base_change_id
+
+def write_incremental(chain_dir: str, source_path: str) -> tuple[int, int]:
+    """Writes every row changed since the chain's last file to a new compressed NDJSON
+    file. Reads run in one transaction on the live database, so WAL gives a consistent
+    view without copying it. Returns (last change_id captured, rows written)."""
+    manifest = load_manifest(chain_dir)
+    incrementals = manifest["incrementals"]
+    from_change_id = incrementals[-1]["to_change_id"] if incrementals else manifest["base_change_id"]
+
+    conn = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    try:
+        conn.execute("BEGIN")
+        changes = conn.execute(
+            "SELECT table_name, row_key, MAX(change_id) FROM change_log WHERE change_id > ? GROUP BY table_name, row_key ORDER BY MAX(change_id)",
+            (from_change_id,)
+        ).fetchall()
+        if not changes:
+            return from_change_id, 0
+
+        created_at = datetime.now().strftime(TIMESTAMP_FORMAT)
+        filename = f"incr_{created_at}.ndjson" + (".zst" if zstandard else ".gz")
+        with _open_text(os.path.join(chain_dir, filename), "w") as f:
+            for table, row_key, _ in changes:
+                key_columns = database.CHANGE_TRACKED_TABLES[table]
+                key = dict(zip(key_columns, json.loads(row_key)))
+                where = " AND ".join(f"{column} = ?" for column in key_columns)
+                row = next(_rows(conn, f"SELECT * FROM {table} WHERE {where}", tuple(key.values())), None)
+                change = {"table": table, "op": "upsert", "row": row} if row else {"table": table, "op": "delete", "key": key}
+                f.write(json.dumps(change, ensure_ascii=False, default=str) + "\n")
+        to_change_id = changes[-1][2]
+    finally:
+        conn.close()
+
+    incrementals.append({"file": filename, "created_at": created_at, "from_change_id": from_change_id, "to_change_id": to_change_id, "rows": len(changes)})
+    _write_manifest(chain_dir, manifest)
+    return to_change_id, len(changes)
+
+def build_restore(chain_dir: str, dest_path: str, until: str = None) -> int:
+    """Rebuilds a database at `dest_path` from the chain's base plus every incremental
+    created at or before `until` (all of them by default). Returns how many were replayed."""
+    manifest = load_manifest(chain_dir)
+    with gzip.open(os.path.join(chain_dir, manifest["base"]), "rb") as src, open(dest_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+    conn = sqlite3.connect(dest_path)
+    replayed = 0
+    try:
+        table_columns = {table: {row[1] for row in conn.execute(f"PRAGMA table_info({table})")} for table in database.CHANGE_TRACKED_TABLES}
+        for entry in manifest["incrementals"]:
+            if until and entry["created_at"] > until:
+                break
+            with _open_text(os.path.join(chain_dir, entry["file"]), "r") as f:
+                for line in f:
+                    change = json.loads(line)
+                    table = change["table"]
+                    key_columns = database.CHANGE_TRACKED_TABLES[table]
+                    if change["op"] == "upsert":
+                        row = change["row"]
+                        if not set(row) <= table_columns[table]:
+                            raise ValueError(f"{entry['file']} has columns that {table} doesn't.")
+                        conn.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", tuple(row.values()))
+                    else:
+                        where = " AND ".join(f"{column} = ?" for column in key_columns)
+                        conn.execute(f"DELETE FROM {table} WHERE {where}", tuple(change["key"][column] for column in key_columns))
+            replayed += 1
+        # The restored database starts a fresh history once it goes live.
+        conn.execute("DELETE FROM change_log")
+        conn.commit()
+    finally:
+        conn.close()
+    return replayed
+
+# --- Retention ---
+def prune_backups(backup_dir: str, now: datetime = None) -> int:
+    """Applies the BACKUP_RETENTION tiers and returns how many files/chains were removed:
+    - incrementals are kept while the chain's newest one is within the hourly window,
+    - every chain within the daily window is kept,
+    - beyond that, the newest chain of each ISO week is kept within the weekly window.
+    The newest chain is never touched. Per-guild JSON exports follow the daily window."""
+    retention = config.BOT_CONFIG["BACKUP_RETENTION"]
+    now = now or datetime.now()
+    hourly_cutoff = (now - timedelta(hours=retention["hourly_hours"])).strftime(TIMESTAMP_FORMAT)
+    daily_cutoff = now - timedelta(days=retention["daily_days"])
+    weekly_cutoff = now - timedelta(weeks=retention["weekly_weeks"])
+    removed = 0
+
+    weeks_kept = set()
+    for i, name in enumerate(reversed(list_chains(backup_dir))):
+        chain_dir = chain_path(backup_dir, name)
+        if i == 0:
+            weeks_kept.add(datetime.strptime(name, TIMESTAMP_FORMAT).isocalendar()[:2])
+            continue
+        created = datetime.strptime(name, TIMESTAMP_FORMAT)
+        week = created.isocalendar()[:2]
+        if created < daily_cutoff and (created < weekly_cutoff or week in weeks_kept):
+            shutil.rmtree(chain_dir)
+            removed += 1
+            continue
+        weeks_kept.add(week)
+
+        manifest = load_manifest(chain_dir)
+        incrementals = manifest["incrementals"]
+        # Incrementals only replay in order, so a chain drops all of them or none.
+        if incrementals and incrementals[-1]["created_at"] < hourly_cutoff:
+            for entry in incrementals:
+                os.remove(os.path.join(chain_dir, entry["file"]))
+                removed += 1
+            manifest["incrementals"] = []
+            _write_manifest(chain_dir, manifest)
+
+    export_cutoff = daily_cutoff.timestamp()
+    for entry in os.scandir(backup_dir):
+        if not entry.is_dir() or entry.name == CHAINS_DIRNAME:
+            continue
+        for export in os.scandir(entry.path):
+            if export.name.endswith("_backup.json") and export.stat().st_mtime < export_cutoff:
+                os.remove(export.path)
+                removed += 1
+    return removed
@@ -0,0 +1,93 @@
+import io
+import math
+import random
+import secrets
+
+try:
+    from PIL import Image, ImageDraw, ImageFilter, ImageFont
+except ImportError: # Pillow is optional; verification falls back to text challenges
+    Image = None
+
+# Ambiguous glyphs (0/O, 1/I/L) are left out so humans don't fail on them.
+CAPTCHA_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+CAPTCHA_LENGTH = 6
+IMAGE_SIZE = (280, 100)
+FONT_SIZE = 48
+FONT_CANDIDATES = ("DejaVuSans-Bold.ttf", "arialbd.ttf", "Arial Bold.ttf")
+
+def is_available() -> bool:
+    return Image is not None
+
+def random_text(length: int = CAPTCHA_LENGTH) -> str:
+    return ''.join(secrets.choice(CAPTCHA_ALPHABET) for _ in range(length))
+
+def init_worker():
+    """Reseeds the distortion RNG; forked workers would otherwise share the parent's state."""
+    random.seed()
+
+def _load_font():
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, FONT_SIZE)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=FONT_SIZE)
+    except TypeError: # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+def _random_color(low: int, high: int) -> tuple:
+    return tuple(random.randint(low, high) for _ in range(3))
+
+def _wave(image):
+    """Shifts each column vertically along a random sine wave."""
+    width, height = image.size
+    amplitude = random.uniform(4, 7)
+    period = random.uniform(60, 110)
+    phase = random.uniform(0, math.tau)
+    warped = Image.new("RGB", image.size, (255, 255, 255))
+    for x in range(width):
+        offset = int(amplitude * math.sin(phase + x * math.tau / period))
+        column = image.crop((x, 0, x + 1, height))
+        warped.paste(column, (x, offset))
+    return warped
+
+def render_captcha(text: str) -> bytes:
+    """Renders `text` as a distorted PNG. Runs in a worker process, so it must only
+    touch its arguments and module-level state."""
+    font = _load_font()
+    width, height = IMAGE_SIZE
+    image = Image.new("RGB", IMAGE_SIZE, _random_color(230, 255))
+    draw = ImageDraw.Draw(image)
+
+    # Background clutter drawn first so the glyphs stay on top.
+    for _ in range(6):
+        x0, y0 = random.randint(-40, width), random.randint(-40, height)
+        draw.arc((x0, y0, x0 + random.randint(40, 160), y0 + random.randint(30, 90)),
+                 random.randint(0, 360), random.randint(0, 360), fill=_random_color(120, 200), width=2)
+
+    step = (width - 30) // len(text)
+    for i, char in enumerate(text):
+        glyph = Image.new("RGBA", (FONT_SIZE + 20, FONT_SIZE + 20), (0, 0, 0, 0))
+        ImageDraw.Draw(glyph).text((10, 5), char, font=font, fill=_random_color(0, 110))
+        glyph = glyph.rotate(random.uniform(-30, 30), resample=Image.BICUBIC, expand=True)
+        x = 15 + i * step + random.randint(-4, 4)
+        y = (height - glyph.size[1]) // 2 + random.randint(-8, 8)
+        image.paste(glyph, (x, y), glyph)
+
+    image = _wave(image)
+    draw = ImageDraw.Draw(image)
+    for _ in range(3):
+        points = [(x, random.randint(10, height - 10)) for x in range(0, width + 1, width // 4)]
+        draw.line(points, fill=_random_color(0, 120), width=2)
+    for _ in range(400):
+        draw.point((random.randrange(width), random.randrange(height)), fill=_random_color(0, 255))
+
+    buffer = io.BytesIO()
+    image.filter(ImageFilter.SMOOTH).save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def generate_challenge(length: int = CAPTCHA_LENGTH) -> tuple[str, bytes]:
+    """Returns (answer, png_bytes). Process pool entry point."""
+    text = random_text(length)
+    return text, render_captcha(text)
@@ -1,14 +1,134 @@
 import discord
 from discord.ext import commands
+import asyncio
 import logging
+import time
 import database
 import config 
+import metrics
 
 log = logging.getLogger(__name__)
 
+JOIN_WORKERS = 4 # Concurrent unverified-role assignments across all guilds
+JOIN_MAX_ATTEMPTS = 5
+
 class EventsCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.member_counts = {} # guild_id -> eligible member count, kept up to date by the member listeners
+        self.join_queue = asyncio.Queue() # (member, joined_at, attempt) waiting for the unverified role
+        self.join_workers = []
+        # Role edits share one rate-limit bucket per guild, so a 429 for one member pauses the whole guild.
+        self.rate_limited_until = {} # guild_id -> time.monotonic() deadline
+
+    async def cog_load(self):
+        self.join_workers = [asyncio.create_task(self._join_worker()) for _ in range(JOIN_WORKERS)]
+
+    def cog_unload(self):
+        for task in self.join_workers:
+            task.cancel()
+
+    # --- JOIN PROCESSING ---
+    async def _join_worker(self):
+        while True:
+            member, joined_at, attempt = await self.join_queue.get()
+            try:
+                await self._assign_unverified_role(member, joined_at, attempt)
+            except Exception as e:
+                log.error(f"Failed to process join of {member} in guild {member.guild.id}: {e}", exc_info=True)
+            finally:
+                metrics.set_gauge("joins.queue_depth", self.join_queue.qsize())
+
+    def _requeue_join(self, delay: float, member: discord.Member, joined_at: float, attempt: int):
+        """Puts a join back on the queue once `delay` has passed, leaving the worker free for other guilds."""
+        asyncio.get_running_loop().call_later(delay, self.join_queue.put_nowait, (member, joined_at, attempt))
+
+    async def _assign_unverified_role(self, member: discord.Member, joined_at: float, attempt: int):
+        guild = member.guild
+        backoff = self.rate_limited_until.get(guild.id, 0) - time.monotonic()
+        if backoff > 0:
+            self._requeue_join(backoff, member, joined_at, attempt)
+            return
+        if not guild.get_member(member.id):
+            metrics.incr("joins.left_before_role")
+            return
+
+        unverified_role_id = await database.get_setting(guild.id, 'unverified_role_id')
+        if not unverified_role_id:
+            return
+        unverified_role = guild.get_role(unverified_role_id)
+        if not unverified_role:
+            log.error(f"Could not find the configured unverified role ({unverified_role_id}) in guild {guild.id}.")
+            return
+
+        try:
+            await member.add_roles(unverified_role, reason="New member join")
+        except discord.Forbidden:
+            log.error(f"Failed to assign unverified role to {member} in guild {guild.id}. Missing permissions.")
+            return
+        except (discord.RateLimited, discord.HTTPException) as e:
+            if isinstance(e, discord.RateLimited):
+                retry_after = e.retry_after
+            elif e.status == 429:
+                retry_after = float(e.response.headers.get('Retry-After', 1))
+            else:
+                raise
+            metrics.incr("joins.rate_limited")
+            self.rate_limited_until[guild.id] = max(self.rate_limited_until.get(guild.id, 0), time.monotonic() + retry_after)
+            if attempt < JOIN_MAX_ATTEMPTS:
+                self._requeue_join(retry_after, member, joined_at, attempt + 1)
+            else:
+                log.error(f"Gave up assigning unverified role to {member} in guild {guild.id} after {attempt} rate-limited attempts.")
+            return
+
+        metrics.observe("joins.join_to_role", time.perf_counter() - joined_at)
+        log.info(f"Assigned unverified role to {member} in guild {guild.id}.")
+
+    # --- MILESTONE MEMBER COUNTER ---
+    @staticmethod
+    def _is_eligible(member: discord.Member) -> bool:
+        """Whether a member counts towards milestones: no bots and no excluded IDs."""
+        return not member.bot and member.id not in config.BOT_CONFIG.get("MILESTONE_EXCLUDED_IDS", [])
+
+    def _count_members(self, guild: discord.Guild) -> int:
+        """Full O(members) count. Only cached once the member list is complete."""
+        count = sum(1 for member in guild.members if self._is_eligible(member))
+        if guild.chunked:
+            self.member_counts[guild.id] = count
+        return count
+
+    def _eligible_member_count(self, guild: discord.Guild) -> int:
+        if guild.id in self.member_counts:
+            return self.member_counts[guild.id]
+        return self._count_members(guild)
+
+    def _adjust_member_count(self, guild: discord.Guild, delta: int):
+        if guild.id in self.member_counts:
+            self.member_counts[guild.id] += delta
+
+    def reset_member_counts(self, guilds):
+        """Drops the cached counts for `guilds` and recounts them from the member cache. Used whenever
+        that cache is (re)built, since joins and leaves during a reconnect never reach the listeners.
+        MILESTONE_EXCLUDED_IDS only changes with a restart, which starts from empty counts anyway."""
+        for guild in guilds:
+            self.member_counts.pop(guild.id, None)
+            self._count_members(guild)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.reset_member_counts(self.bot.guilds)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        self.reset_member_counts([guild])
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        self.reset_member_counts([guild])
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.member_counts.pop(guild.id, None)
 
     async def _check_milestones(self, guild: discord.Guild):
         # Use a more descriptive database key to store the last count
@@ -23,11 +143,8 @@ class EventsCog(commands.Cog):
             # Calculate the next multiple of 50
             next_milestone = ((last_announced_milestone // increment) + 1) * increment
 
-        # Get the list of user IDs to exclude from the member count
-        excluded_ids = set(config.BOT_CONFIG.get("MILESTONE_EXCLUDED_IDS", []))
-        
-        # Calculate the current member count, excluding bots and specified IDs
-        eligible_member_count = sum(1 for member in guild.members if not member.bot and member.id not in excluded_ids)
+        # Current count of eligible members (no bots or excluded IDs), kept by the member listeners
+        eligible_member_count = self._eligible_member_count(guild)
         
         # --- FIXED LOGIC ---
         # Use a 'while' loop to handle multiple milestone achievements at once
@@ -67,23 +184,25 @@ class EventsCog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
+        if self._is_eligible(member):
+            self._adjust_member_count(member.guild, 1)
         if member.bot: return
         
-        # Assign the unverified role upon joining
-        unverified_role_id = await database.get_setting(member.guild.id, 'unverified_role_id')
-        if unverified_role_id:
-            unverified_role = member.guild.get_role(unverified_role_id)
-            if unverified_role:
-                try:
-                    await member.add_roles(unverified_role, reason="New member join")
-                    log.info(f"Assigned unverified role to {member} in guild {member.guild.id}.")
-                except discord.Forbidden:
-                    log.error(f"Failed to assign unverified role to {member} in guild {member.guild.id}. Missing permissions.")
-            else:
-                log.error(f"Could not find the configured unverified role ({unverified_role_id}) in guild {member.guild.id}.")
+        # The unverified role is assigned by the join workers so a raid never blocks the gateway handler
+        self.join_queue.put_nowait((member, time.perf_counter(), 1))
+        metrics.set_gauge("joins.queue_depth", self.join_queue.qsize())
 
         # Check for new milestones after a member joins
         await self._check_milestones(member.guild)
 
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if not self._is_eligible(member):
+            return
+        self._adjust_member_count(member.guild, -1)
+        # Announced milestones are never repeated, so this only catches up on ones
+        # a failed announcement left pending.
+        await self._check_milestones(member.guild)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(EventsCog(bot))
@@ -4,6 +4,7 @@ from discord.ext import commands
 from datetime import datetime, timezone, timedelta
 import logging
 import re
+import weakref
 
 import database
 import config
@@ -11,13 +12,20 @@ import utils
 
 log = logging.getLogger(__name__)
 
-async def _mute_member(interaction_or_message: discord.Interaction | discord.Message, target: discord.Member, duration_minutes: int, reason: str, moderator: discord.Member):
+def _unmute_key(guild_id: int, user_id: int) -> str:
+    return f"unmute:{guild_id}:{user_id}"
+
+def _approval_key(message_id: int) -> str:
+    return f"approval:{message_id}"
+
+async def _mute_member(bot: commands.Bot, target: discord.Member, duration_minutes: int, reason: str, moderator: discord.Member):
     guild = target.guild
     log_channel_id = await database.get_setting(guild.id, 'log_channel_id')
     log_channel = guild.get_channel(log_channel_id) if log_channel_id else None
     duration = timedelta(minutes=duration_minutes)
     try:
         await target.timeout(duration, reason=f"{reason} - by {moderator}")
+        await bot.scheduler.schedule("moderation.unmute", delay=duration.total_seconds(), payload={"guild_id": guild.id, "user_id": target.id}, key=_unmute_key(guild.id, target.id))
         try:
             dm_embed = discord.Embed(title="You have been muted", description=f"You were muted in **{guild.name}**.", color=config.BOT_CONFIG["EMBED_COLORS"]["WARNING"])
             dm_embed.add_field(name="Duration", value=f"{duration_minutes} minutes")
@@ -55,21 +63,17 @@ async def _ban_member(interaction_or_message: discord.Interaction | discord.Mess
 
 class MuteApprovalView(discord.ui.View):
     def __init__(self, moderator: discord.Member, target: discord.Member, duration: int, reason: str):
-        super().__init__(timeout=config.BOT_CONFIG["APPROVAL_TIMEOUT_SECONDS"])
+        # Expiry is a scheduled job (see ModerationCog.expire_approval) so it survives restarts.
+        super().__init__(timeout=None)
         self.moderator = moderator
         self.target = target
         self.duration = duration
         self.reason = reason
         self.message = None
 
-    async def on_timeout(self):
-        if self.message:
-            await _mute_member(self.message, self.target, config.BOT_CONFIG["DEFAULT_MUTE_MINS"], f"(Auto-Mute) {self.reason}", self.moderator)
-            timeout_embed = discord.Embed(title="⌛ Mute Request Timed Out", description=f"Mute request was not approved.\n**User has been auto-muted for {config.BOT_CONFIG['DEFAULT_MUTE_MINS']} minutes.**", color=discord.Color.gray())
-            await self.message.edit(content=None, embed=timeout_embed, view=None)
-
     async def _update_message(self, interaction: discord.Interaction, approved: bool):
         self.stop()
+        await interaction.client.scheduler.cancel_key(_approval_key(interaction.message.id))
         embed = interaction.message.embeds[0]
         outcome = "Approved" if approved else "Declined"
         color = config.BOT_CONFIG["EMBED_COLORS"]["SUCCESS"] if approved else config.BOT_CONFIG["EMBED_COLORS"]["ERROR"]
@@ -83,7 +87,7 @@ class MuteApprovalView(discord.ui.View):
     async def approve_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await utils.has_admin_role(interaction.user):
             return await interaction.response.send_message("Only Bot Admins can approve this action.", ephemeral=True)
-        success = await _mute_member(interaction, self.target, self.duration, self.reason, self.moderator)
+        success = await _mute_member(interaction.client, self.target, self.duration, self.reason, self.moderator)
         if success: await self._update_message(interaction, approved=True)
         else: await interaction.response.send_message("❌ Failed to mute user. My role might be too low.", ephemeral=True)
 
@@ -95,19 +99,15 @@ class MuteApprovalView(discord.ui.View):
 
 class BanApprovalView(discord.ui.View):
     def __init__(self, moderator: discord.Member, target: discord.Member, reason: str):
-        super().__init__(timeout=config.BOT_CONFIG["APPROVAL_TIMEOUT_SECONDS"])
+        super().__init__(timeout=None)
         self.moderator = moderator
         self.target = target
         self.reason = reason
         self.message = None
 
-    async def on_timeout(self):
-        if self.message:
-            timeout_embed = discord.Embed(title="⌛ Ban Request Timed Out", description=f"The ban request for {self.target.mention} was not actioned in time and has expired.", color=discord.Color.gray())
-            await self.message.edit(content=None, embed=timeout_embed, view=None)
-
     async def _update_message(self, interaction: discord.Interaction, approved: bool):
         self.stop()
+        await interaction.client.scheduler.cancel_key(_approval_key(interaction.message.id))
         embed = interaction.message.embeds[0]
         outcome = "Approved" if approved else "Declined"
         color = config.BOT_CONFIG["EMBED_COLORS"]["SUCCESS"] if approved else config.BOT_CONFIG["EMBED_COLORS"]["ERROR"]
@@ -135,15 +135,10 @@ class BanApprovalView(discord.ui.View):
 
 class BanDecisionView(discord.ui.View):
     def __init__(self, member: discord.Member):
-        super().__init__(timeout=config.BOT_CONFIG["APPROVAL_TIMEOUT_SECONDS"])
+        super().__init__(timeout=None)
         self.member = member
         self.message = None
 
-    async def on_timeout(self):
-        if self.message:
-            timeout_embed = discord.Embed(title="⚠️ Ban Request Expired", description=f"Ban request for {self.member.mention} expired.", color=discord.Color.gray())
-            await self.message.edit(content=None, embed=timeout_embed, view=None)
-
     @discord.ui.button(label="🚫 Ban", style=discord.ButtonStyle.danger)
     async def ban_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await utils.has_mod_role(interaction.user): return await interaction.response.send_message("You don't have permission.", ephemeral=True)
@@ -152,6 +147,7 @@ class BanDecisionView(discord.ui.View):
             final_embed = discord.Embed(title="🔨 User Banned", description=f"{self.member.mention} was banned by {interaction.user.mention}.", color=config.BOT_CONFIG["EMBED_COLORS"]["ERROR"])
             await database.clear_warnings(self.member.guild.id, self.member.id)
             self.stop()
+            await interaction.client.scheduler.cancel_key(_approval_key(interaction.message.id))
             await interaction.response.edit_message(content=None, embed=final_embed, view=None)
         except discord.Forbidden: return await interaction.response.send_message("❌ Failed to ban user.", ephemeral=True)
 
@@ -161,6 +157,7 @@ class BanDecisionView(discord.ui.View):
         final_embed = discord.Embed(title="✅ User Forgiven", description=f"All warnings for {self.member.mention} have been cleared by {interaction.user.mention}.", color=config.BOT_CONFIG["EMBED_COLORS"]["SUCCESS"])
         await database.clear_warnings(self.member.guild.id, self.member.id)
         self.stop()
+        await interaction.client.scheduler.cancel_key(_approval_key(interaction.message.id))
         await interaction.response.edit_message(content=None, embed=final_embed, view=None)
 
 @app_commands.guild_only()
@@ -168,20 +165,92 @@ class ModerationCog(commands.Cog, name="Moderation"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.bad_words_cache = {}
+        self.approval_views = weakref.WeakValueDictionary() # message_id -> live approval view
+
+    async def cog_load(self):
+        self.bot.scheduler.register("moderation.unmute", self.expire_mute)
+        self.bot.scheduler.register("moderation.approval_expiry", self.expire_approval)
+        database.subscribe(database.EVENT_BAD_WORDS_CHANGED, self._update_bad_words_cache)
+        database.subscribe(database.EVENT_DATABASE_RESTORED, self._reload_bad_words_cache)
+
+    def cog_unload(self):
+        database.unsubscribe(database.EVENT_BAD_WORDS_CHANGED, self._update_bad_words_cache)
+        database.unsubscribe(database.EVENT_DATABASE_RESTORED, self._reload_bad_words_cache)
+
+    # --- SCHEDULED JOBS ---
+    async def _track_approval(self, view: discord.ui.View, message: discord.Message, kind: str, target: discord.Member, moderator: discord.abc.User = None, reason: str = None):
+        """Schedules the expiry of an approval request posted in `message`."""
+        view.message = message
+        self.approval_views[message.id] = view
+        payload = {
+            "kind": kind, "guild_id": message.guild.id, "channel_id": message.channel.id, "message_id": message.id,
+            "target_id": target.id, "moderator_id": moderator.id if moderator else None, "reason": reason,
+        }
+        await self.bot.scheduler.schedule("moderation.approval_expiry", delay=config.BOT_CONFIG["APPROVAL_TIMEOUT_SECONDS"], payload=payload, key=_approval_key(message.id))
+
+    async def expire_mute(self, payload: dict):
+        """Lifts a timed mute once its duration is up and logs it."""
+        guild = self.bot.get_guild(payload["guild_id"])
+        member = guild.get_member(payload["user_id"]) if guild else None
+        if not member:
+            return
+        if member.is_timed_out():
+            try:
+                await member.timeout(None, reason="Mute expired")
+            except discord.Forbidden:
+                log.warning(f"Could not lift the expired mute of {member.id} in guild {guild.id}.")
+        log_channel_id = await database.get_setting(guild.id, 'log_channel_id')
+        log_channel = guild.get_channel(log_channel_id) if log_channel_id else None
+        if log_channel:
+            embed = discord.Embed(title="🔊 User Unmuted (mute expired)", color=config.BOT_CONFIG["EMBED_COLORS"]["SUCCESS"], timestamp=datetime.now(timezone.utc))
+            embed.add_field(name="User", value=member.mention)
+            await log_channel.send(embed=embed)
+
+    async def expire_approval(self, payload: dict):
+        """Closes an approval request nobody acted on. Mute requests fall back to a default-length mute."""
+        view = self.approval_views.pop(payload["message_id"], None)
+        if view:
+            view.stop()
+        guild = self.bot.get_guild(payload["guild_id"])
+        channel = guild.get_channel_or_thread(payload["channel_id"]) if guild else None
+        if not channel:
+            return
+        try:
+            message = await channel.fetch_message(payload["message_id"])
+        except discord.NotFound:
+            return
+        if not message.components:
+            return # Already decided
+
+        target_mention = f"<@{payload['target_id']}>"
+        if payload["kind"] == "mute":
+            target = guild.get_member(payload["target_id"])
+            moderator = guild.get_member(payload["moderator_id"]) or self.bot.user
+            if target:
+                await _mute_member(self.bot, target, config.BOT_CONFIG["DEFAULT_MUTE_MINS"], f"(Auto-Mute) {payload['reason']}", moderator)
+            embed = discord.Embed(title="⌛ Mute Request Timed Out", description=f"Mute request was not approved.\n**User has been auto-muted for {config.BOT_CONFIG['DEFAULT_MUTE_MINS']} minutes.**", color=discord.Color.gray())
+        elif payload["kind"] == "ban":
+            embed = discord.Embed(title="⌛ Ban Request Timed Out", description=f"The ban request for {target_mention} was not actioned in time and has expired.", color=discord.Color.gray())
+        else:
+            embed = discord.Embed(title="⚠️ Ban Request Expired", description=f"Ban request for {target_mention} expired.", color=discord.Color.gray())
+        await message.edit(content=None, embed=embed, view=None)
 
     async def _update_bad_words_cache(self, guild_id: int):
         """Fetches bad words from the database and updates the cache for a single guild."""
         self.bad_words_cache[guild_id] = await database.get_bad_words(guild_id)
         log.info(f"Updated bad words cache for guild {guild_id}.")
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        """Populates the cache when the bot starts."""
+    async def _reload_bad_words_cache(self):
         log.info("Populating bad words cache for all guilds...")
         for guild in self.bot.guilds:
             await self._update_bad_words_cache(guild.id)
         log.info("Bad words cache populated.")
 
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Populates the cache when the bot starts."""
+        await self._reload_bad_words_cache()
+
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
         """Adds a new guild to the cache when the bot joins."""
@@ -230,7 +299,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
 
             ctx = interaction or original_message
             if action_type == 'mute':
-                await _mute_member(ctx, target, duration, action_reason, self.bot.user)
+                await _mute_member(self.bot, target, duration, action_reason, self.bot.user)
                 action_log_embed.title = f"User Auto-Muted ({new_warnings_count}/{warning_limit})"
             elif action_type == 'kick':
                 await target.kick(reason=action_reason)
@@ -293,7 +362,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
             view = BanDecisionView(member=message.author)
             mentions = await utils.get_log_mentions(message.guild.id)
             await warning_msg.edit(content=mentions, embed=log_embed, view=view)
-            view.message = warning_msg
+            await self._track_approval(view, warning_msg, "ban_decision", message.author)
         else:
             await warning_msg.edit(embed=log_embed)
 
@@ -304,8 +373,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
     async def filter_add(self, interaction: discord.Interaction, word: str):
         success = await database.add_bad_word(interaction.guild.id, word)
         if success:
-            # --- IMPROVED: Update the cache after changing the database ---
-            await self._update_bad_words_cache(interaction.guild.id)
+            # The cache refreshes itself from the bad_words_changed event
             await interaction.response.send_message(f"✅ The word `||{word}||` has been added to the filter.", ephemeral=True)
         else:
             await interaction.response.send_message(f"⚠️ The word `||{word}||` is already in the filter.", ephemeral=True)
@@ -315,7 +383,6 @@ class ModerationCog(commands.Cog, name="Moderation"):
     async def filter_remove(self, interaction: discord.Interaction, word: str):
         success = await database.remove_bad_word(interaction.guild.id, word)
         if success:
-            await self._update_bad_words_cache(interaction.guild.id)
             await interaction.response.send_message(f"✅ The word `||{word}||` has been removed from the filter.", ephemeral=True)
         else:
             await interaction.response.send_message(f"⚠️ The word `||{word}||` was not found in the filter.", ephemeral=True)
@@ -349,7 +416,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
         
         is_admin = await utils.has_admin_role(interaction.user)
         if is_admin:
-            success = await _mute_member(interaction, member, minutes, reason, interaction.user)
+            success = await _mute_member(self.bot, member, minutes, reason, interaction.user)
             if success: await interaction.followup.send(f"🔇 **{member.display_name}** has been muted for {minutes} minutes.", ephemeral=True)
             else: await interaction.followup.send("❌ Failed to mute user. My role might be too low.", ephemeral=True)
         else:
@@ -361,7 +428,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
             view = MuteApprovalView(interaction.user, member, minutes, reason)
             mentions = await utils.get_log_mentions(interaction.guild.id)
             msg = await log_channel.send(content=mentions, embed=embed, view=view)
-            view.message = msg
+            await self._track_approval(view, msg, "mute", member, interaction.user, reason)
             await interaction.followup.send(f"✅ Your mute request has been sent for approval.", ephemeral=True)
 
     @mod_group.command(name="unmute", description="Removes a user's timeout.")
@@ -372,6 +439,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
             return await interaction.response.send_message("This user is not currently muted.", ephemeral=True)
         try:
             await member.timeout(None, reason=f"{reason or 'No reason'} - Unmuted by {interaction.user}")
+            await self.bot.scheduler.cancel_key(_unmute_key(interaction.guild.id, member.id))
             log_channel_id = await database.get_setting(interaction.guild.id, 'log_channel_id')
             if log_channel_id:
                 log_channel = self.bot.get_channel(log_channel_id)
@@ -431,7 +499,7 @@ class ModerationCog(commands.Cog, name="Moderation"):
             view = BanApprovalView(interaction.user, member, reason)
             mentions = await utils.get_log_mentions(interaction.guild.id)
             msg = await log_channel.send(content=mentions, embed=embed, view=view)
-            view.message = msg
+            await self._track_approval(view, msg, "ban", member, interaction.user, reason)
             await interaction.followup.send(f"✅ Your ban request has been sent for approval.", ephemeral=True)
 
     @mod_group.command(name="announce", description="Sends a message to the moderator chat channel.")
@@ -8,6 +8,7 @@ import time
 
 import database
 import config 
+import utils
 
 log = logging.getLogger(__name__)
 
@@ -59,8 +60,14 @@ class RankingCog(commands.Cog, name="Ranking"):
         self.bot = bot
         self.xp_cooldowns = defaultdict(int)
         self.cooldown_seconds = 60
+        self.rank_rewards = {} # guild_id -> {rank_level: role_id}, kept current by rank_reward_changed events
+        self.rank_reward_generation = 0 # Bumped on every change, so a load that raced one isn't cached
         self.voice_xp_loop.start()
 
+    async def cog_load(self):
+        database.subscribe(database.EVENT_RANK_REWARD_CHANGED, self._on_rank_reward_changed)
+        database.subscribe(database.EVENT_DATABASE_RESTORED, self._on_database_restored)
+
     async def cog_check(self, interaction: discord.Interaction) -> bool:
         is_enabled = await database.get_setting(interaction.guild.id, 'ranking_system_enabled')
         if not is_enabled:
@@ -69,8 +76,35 @@ class RankingCog(commands.Cog, name="Ranking"):
         return True
 
     def cog_unload(self):
+        database.unsubscribe(database.EVENT_RANK_REWARD_CHANGED, self._on_rank_reward_changed)
+        database.unsubscribe(database.EVENT_DATABASE_RESTORED, self._on_database_restored)
         self.voice_xp_loop.cancel()
 
+    def _on_database_restored(self):
+        self.rank_reward_generation += 1
+        self.rank_rewards.clear()
+
+    def _on_rank_reward_changed(self, guild_id: int, rank_level: int, role_id: int | None):
+        self.rank_reward_generation += 1
+        rewards = self.rank_rewards.get(guild_id)
+        if rewards is None:
+            return # Not loaded yet; the next lookup reads the current data
+        if role_id is None:
+            rewards.pop(rank_level, None)
+        else:
+            rewards[rank_level] = role_id
+
+    async def _get_rank_reward(self, guild_id: int, rank_level: int):
+        rewards = self.rank_rewards.get(guild_id)
+        if rewards is None:
+            generation = self.rank_reward_generation
+            rewards = dict(await database.get_all_rank_rewards(guild_id))
+            # A change that landed while we were reading may be missing from `rewards`;
+            # use them for this lookup only and let the next one reload.
+            if generation == self.rank_reward_generation:
+                self.rank_rewards[guild_id] = rewards
+        return rewards.get(rank_level)
+
     async def _handle_xp_gain(self, guild: discord.Guild, member: discord.Member, xp_to_add: int):
         """A central function to handle adding XP and checking for rank rewards."""
         # Get user's XP *before* adding the new amount
@@ -86,7 +120,7 @@ class RankingCog(commands.Cog, name="Ranking"):
         if new_rank > old_rank:
             log.info(f"User {member.id} in guild {guild.id} ranked up from {old_rank} to {new_rank}.")
             
-            reward_role_id = await database.get_rank_reward(guild.id, new_rank)
+            reward_role_id = await self._get_rank_reward(guild.id, new_rank)
             if reward_role_id:
                 role = guild.get_role(reward_role_id)
                 if role:
@@ -100,8 +134,11 @@ class RankingCog(commands.Cog, name="Ranking"):
 
     @tasks.loop(minutes=5)
     async def voice_xp_loop(self):
-        """Grants XP to active members in voice channels."""
-        for guild in self.bot.guilds:
+        """Grants XP to active members in voice channels, with one pass per connected shard."""
+        await utils.run_per_shard(self.bot, self._grant_voice_xp)
+
+    async def _grant_voice_xp(self, shard_id: int, guilds: list):
+        for guild in guilds:
             if not await database.get_setting(guild.id, 'ranking_system_enabled'):
                 continue
             for channel in guild.voice_channels:
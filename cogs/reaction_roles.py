@@ -1,15 +1,195 @@
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+import asyncio
 import logging
+import re
+from collections import Counter, OrderedDict
 import database
+import metrics
+import utils
 from utils import is_bot_admin
 
 log = logging.getLogger(__name__)
 
+SYNC_BATCH_SIZE = 50 # Role changes applied at once
+SYNC_CHECKPOINT_USERS = 100 # Reactors scanned between checkpoints (one page of the reactions API)
+SYNC_BATCH_PAUSE_SECONDS = 2 # Breather between batches so a big sync leaves room for live events
+RECENT_MESSAGE_INDEX_SIZE = 100 # Messages from /create_reaction_role_message remembered with their channel
+PROBE_CONCURRENCY = 5 # Channels probed at once when only a bare message ID is given
+
+MESSAGE_LINK_RE = re.compile(r"https?://(?:(?:ptb|canary)\.)?discord(?:app)?\.com/channels/(\d+|@me)/(\d+)/(\d+)")
+CHANNEL_MESSAGE_RE = re.compile(r"(\d+)\s*[-/\s]\s*(\d+)")
+
+def parse_message_reference(text: str):
+    """Parses a message link, a `channel-message` ID pair (as copied with Shift held) or a
+    bare message ID. Returns (guild_id, channel_id, message_id); unknown parts are None."""
+    text = text.strip()
+    if match := MESSAGE_LINK_RE.fullmatch(text):
+        guild_id = None if match[1] == "@me" else int(match[1])
+        return guild_id, int(match[2]), int(match[3])
+    if match := CHANNEL_MESSAGE_RE.fullmatch(text):
+        return None, int(match[1]), int(match[2])
+    return None, None, int(text)
+
 class ReactionRolesCog(commands.Cog, name="Reaction Roles"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.reaction_roles: dict[int, dict[str, int]] = {} # message_id -> {emoji: role_id}
+        self.sync_lock = asyncio.Lock()
+        self.recent_messages: OrderedDict[int, int] = OrderedDict() # message_id -> channel_id
+
+    async def cog_load(self):
+        self.reaction_roles = await database.get_all_reaction_roles()
+        log.info(f"Loaded reaction roles for {len(self.reaction_roles)} messages.")
+        self.reconcile_loop.start()
+
+    def cog_unload(self):
+        self.reconcile_loop.cancel()
+
+    async def forget_messages(self, message_ids):
+        """Drops mappings for deleted messages from the cache and the database."""
+        stale = [message_id for message_id in message_ids if self.reaction_roles.pop(message_id, None) is not None]
+        if stale:
+            await database.delete_reaction_roles_for_messages(stale)
+            log.info(f"Removed reaction roles for {len(stale)} deleted messages.")
+
+    def remember_message(self, message: discord.Message):
+        self.recent_messages[message.id] = message.channel.id
+        self.recent_messages.move_to_end(message.id)
+        while len(self.recent_messages) > RECENT_MESSAGE_INDEX_SIZE:
+            self.recent_messages.popitem(last=False)
+
+    async def _fetch_from(self, channel, message_id: int):
+        try:
+            return await channel.fetch_message(message_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+
+    async def find_message(self, guild: discord.Guild, message_id: int, channel_id: int = None):
+        """Fetches a message by ID. A known channel (from the caller or the recent-message
+        index) costs one call; the bot's message cache costs none. Otherwise only channels
+        that could contain the message are probed, a few at a time."""
+        channel_id = channel_id or self.recent_messages.get(message_id)
+        if channel_id:
+            channel = guild.get_channel_or_thread(channel_id)
+            return await self._fetch_from(channel, message_id) if channel else None
+
+        cached = discord.utils.get(self.bot.cached_messages, id=message_id)
+        if cached and cached.guild == guild:
+            return cached
+
+        # A message can't be older than its channel, or newer than the channel's latest message.
+        candidates = [
+            channel for channel in guild.text_channels
+            if channel.id <= message_id and (channel.last_message_id is None or channel.last_message_id >= message_id)
+        ]
+        candidates.sort(key=lambda channel: abs((channel.last_message_id or channel.id) - message_id))
+        for i in range(0, len(candidates), PROBE_CONCURRENCY):
+            chunk = candidates[i:i + PROBE_CONCURRENCY]
+            metrics.incr("reaction_roles.probe_calls", len(chunk))
+            for message in await asyncio.gather(*(self._fetch_from(channel, message_id) for channel in chunk)):
+                if message:
+                    return message
+        return None
+
+    # --- OFFLINE RECONCILIATION ---
+    async def _apply_batch(self, members: list, role: discord.Role, add: bool):
+        for member in members:
+            try:
+                if add:
+                    await utils.call_with_rate_limit_retry(lambda: member.add_roles(role, reason="Reaction Role (sync)"))
+                else:
+                    await utils.call_with_rate_limit_retry(lambda: member.remove_roles(role, reason="Reaction Role Removed (sync)"))
+            except discord.HTTPException as e:
+                log.warning(f"Reaction role sync could not update {member.id} in guild {member.guild.id}: {e}")
+        metrics.incr("reaction_roles.sync_added" if add else "reaction_roles.sync_removed", len(members))
+        await asyncio.sleep(SYNC_BATCH_PAUSE_SECONDS)
+
+    async def _sync_reaction(self, message: discord.Message, emoji: str, role: discord.Role, removals_allowed: bool):
+        """Streams everyone who reacted with `emoji` and grants the role to those missing it,
+        checkpointing after each page of reactors so an interrupted run resumes where it stopped.
+        Reactors are remembered, and after a complete, un-resumed pass the role is only removed
+        from remembered reactors who have since taken their reaction back; roles given by hand
+        are left alone."""
+        reaction = discord.utils.find(lambda r: str(r.emoji) == emoji, message.reactions)
+        if reaction is None:
+            # Even the bot's own reaction is gone; don't strip roles on that basis.
+            log.warning(f"Reaction {emoji} is missing from reaction-role message {message.id}; skipping sync.")
+            return
+        checkpoint = await database.get_reaction_sync_checkpoint(message.id, emoji)
+        after = discord.Object(id=checkpoint) if checkpoint else None
+        tracked = await database.get_reaction_role_members(message.id, emoji)
+        reacted, page, pending = set(), [], []
+        async for user in reaction.users(limit=None, after=after):
+            if user.bot: continue
+            reacted.add(user.id)
+            page.append(user.id)
+            member = user if isinstance(user, discord.Member) else message.guild.get_member(user.id)
+            if member and role not in member.roles:
+                pending.append(member)
+            if len(pending) >= SYNC_BATCH_SIZE:
+                await self._apply_batch(pending, role, add=True)
+                pending = []
+            if len(page) >= SYNC_CHECKPOINT_USERS:
+                await self._checkpoint(message, emoji, role, page, pending)
+                page, pending = [], []
+        if page:
+            await self._checkpoint(message, emoji, role, page, pending)
+
+        if removals_allowed and checkpoint is None:
+            gone = tracked - reacted
+            stale = [member for member in map(message.guild.get_member, gone) if member and role in member.roles]
+            for i in range(0, len(stale), SYNC_BATCH_SIZE):
+                await self._apply_batch(stale[i:i + SYNC_BATCH_SIZE], role, add=False)
+            await database.remove_reaction_role_members(message.id, emoji, gone)
+        await database.clear_reaction_sync_checkpoint(message.id, emoji)
+
+    async def _checkpoint(self, message: discord.Message, emoji: str, role: discord.Role, page: list, pending: list):
+        """Applies outstanding grants, remembers the page's reactors and saves the resume point."""
+        if pending:
+            await self._apply_batch(pending, role, add=True)
+        await database.add_reaction_role_members(message.id, emoji, page)
+        await database.save_reaction_sync_checkpoint(message.id, emoji, page[-1])
+
+    async def reconcile_reaction_roles(self):
+        """Applies reactions that were added or removed while the bot was offline."""
+        if self.sync_lock.locked():
+            return
+        async with self.sync_lock:
+            # A role handed out by several messages/emojis can't be removed based on one of them.
+            role_uses = Counter(role_id for roles in self.reaction_roles.values() for role_id in roles.values())
+            for guild_id, channel_id, message_id in await database.get_reaction_role_messages():
+                guild = self.bot.get_guild(guild_id)
+                mapping = self.reaction_roles.get(message_id)
+                if not guild or not mapping: continue
+                message = await self.find_message(guild, message_id, channel_id)
+                if not message:
+                    log.warning(f"Reaction-role message {message_id} in guild {guild_id} could not be fetched; skipping sync.")
+                    continue
+                if channel_id != message.channel.id:
+                    await database.set_reaction_role_channel(message_id, message.channel.id)
+
+                for emoji, role_id in mapping.items():
+                    role = guild.get_role(role_id)
+                    if not role: continue
+                    try:
+                        await self._sync_reaction(message, emoji, role, removals_allowed=role_uses[role_id] == 1)
+                    except discord.HTTPException as e:
+                        log.error(f"Reaction role sync failed for message {message_id} ({emoji}): {e}")
+            log.info("Reaction role reconciliation finished.")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.reconcile_reaction_roles()
+
+    @tasks.loop(hours=6)
+    async def reconcile_loop(self):
+        await self.reconcile_reaction_roles()
+
+    @reconcile_loop.before_loop
+    async def before_reconcile_loop(self):
+        await self.bot.wait_until_ready()
 
     @app_commands.command(name="create_reaction_role_message", description="Creates a new message for reaction roles.")
     @app_commands.guild_only()
@@ -19,6 +199,7 @@ class ReactionRolesCog(commands.Cog, name="Reaction Roles"):
         await interaction.response.defer(ephemeral=True)
         try:
             message = await channel.send(message_content)
+            self.remember_message(message)
             await interaction.followup.send(f"✅ Message created with ID: `{message.id}`. Now use `/set_reaction_role`.", ephemeral=True)
         except discord.Forbidden:
             await interaction.followup.send("I don't have permission to send messages in that channel.", ephemeral=True)
@@ -26,42 +207,46 @@ class ReactionRolesCog(commands.Cog, name="Reaction Roles"):
     @app_commands.command(name="set_reaction_role", description="Adds a reaction-role mapping to a message.")
     @app_commands.guild_only()
     @is_bot_admin()
-    @app_commands.describe(message_id="The ID of the message to add the reaction role to.", emoji="The emoji for the reaction.", role="The role to assign.")
+    @app_commands.describe(message_id="A link to the message, a channel-message ID pair, or the message ID.", emoji="The emoji for the reaction.", role="The role to assign.")
     async def set_reaction_role(self, interaction: discord.Interaction, message_id: str, emoji: str, role: discord.Role):
         await interaction.response.defer(ephemeral=True)
         if role >= interaction.guild.me.top_role:
             return await interaction.followup.send(f"I cannot assign **{role.name}** as it's higher than my own role.", ephemeral=True)
         try:
-            msg = None
-            for channel in interaction.guild.text_channels:
-                try:
-                    msg = await channel.fetch_message(int(message_id))
-                    break
-                except (discord.NotFound, discord.Forbidden): continue
+            guild_id, channel_id, target_id = parse_message_reference(message_id)
+            if guild_id is not None and guild_id != interaction.guild.id:
+                return await interaction.followup.send("That message link points to a different server.", ephemeral=True)
+            msg = await self.find_message(interaction.guild, target_id, channel_id)
             if not msg: return await interaction.followup.send("Could not find a message with that ID.", ephemeral=True)
+            self.remember_message(msg)
             await msg.add_reaction(emoji)
-            await database.add_reaction_role(interaction.guild.id, msg.id, emoji, role.id)
+            await database.add_reaction_role(interaction.guild.id, msg.id, emoji, role.id, msg.channel.id)
+            self.reaction_roles.setdefault(msg.id, {})[emoji] = role.id
             await interaction.followup.send(f"✅ Reaction role set for {emoji} to give {role.mention}.", ephemeral=True)
         except (ValueError, discord.HTTPException):
             await interaction.followup.send("Invalid message ID or emoji.", ephemeral=True)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
-        if not payload.guild_id or (payload.member and payload.member.bot): return
-        role_id = await database.get_reaction_role(payload.message_id, str(payload.emoji))
+        mapping = self.reaction_roles.get(payload.message_id)
+        if not mapping or not payload.guild_id or (payload.member and payload.member.bot): return
+        role_id = mapping.get(str(payload.emoji))
         if role_id:
             guild = self.bot.get_guild(payload.guild_id)
             role = guild.get_role(role_id)
             if role and payload.member:
+                await database.add_reaction_role_members(payload.message_id, str(payload.emoji), [payload.user_id])
                 try:
                     await payload.member.add_roles(role, reason="Reaction Role")
                 except discord.Forbidden: pass
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
-        if not payload.guild_id: return
-        role_id = await database.get_reaction_role(payload.message_id, str(payload.emoji))
+        mapping = self.reaction_roles.get(payload.message_id)
+        if not mapping or not payload.guild_id: return
+        role_id = mapping.get(str(payload.emoji))
         if role_id:
+            await database.remove_reaction_role_members(payload.message_id, str(payload.emoji), [payload.user_id])
             guild = self.bot.get_guild(payload.guild_id)
             member = guild.get_member(payload.user_id)
             role = guild.get_role(role_id)
@@ -70,5 +255,14 @@ class ReactionRolesCog(commands.Cog, name="Reaction Roles"):
                     await member.remove_roles(role, reason="Reaction Role Removed")
                 except discord.Forbidden: pass
 
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.message_id in self.reaction_roles:
+            await self.forget_messages([payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        await self.forget_messages(payload.message_ids)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(ReactionRolesCog(bot))
\ No newline at end of file
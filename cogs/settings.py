@@ -5,7 +5,7 @@ from typing import List, Optional
 
 import database
 import config
-from utils import is_bot_admin
+from utils import is_bot_admin, get_permission_roles
 
 # --- Reusable Dropdown Components ---
 class ChannelSelect(discord.ui.ChannelSelect):
@@ -55,25 +55,19 @@ class RoleManagementSelect(discord.ui.RoleSelect):
 
     async def callback(self, interaction: discord.Interaction):
         role = self.values[0]
-        setting_name = f"{self.role_type}_role_ids"
-        roles_str = await database.get_setting(interaction.guild.id, setting_name) or ""
-        role_ids = [r for r in roles_str.split(',') if r]
 
         if self.action == "add":
-            if str(role.id) not in role_ids:
-                role_ids.append(str(role.id))
+            if await database.add_permission_role(interaction.guild.id, role.id, self.role_type):
                 await interaction.response.send_message(f"✅ {role.mention} added as a bot {self.role_type}.", ephemeral=True)
             else:
                 await interaction.response.send_message(f"⚠️ {role.mention} is already a bot {self.role_type}.", ephemeral=True)
         
         elif self.action == "remove":
-            if str(role.id) in role_ids:
-                role_ids.remove(str(role.id))
+            if await database.remove_permission_role(interaction.guild.id, role.id, self.role_type):
                 await interaction.response.send_message(f"✅ {role.mention} removed as a bot {self.role_type}.", ephemeral=True)
             else:
                 await interaction.response.send_message(f"⚠️ {role.mention} is not a bot {self.role_type}.", ephemeral=True)
         
-        await database.update_setting(interaction.guild.id, setting_name, ",".join(role_ids))
         await self.parent_view.refresh_and_show(interaction, edit_original=True)
 
 
@@ -170,6 +164,25 @@ class TempVCSettingsView(BaseSettingsView):
         self.add_item(ChannelSelect("temp_vc_hub_id", "Set 'Join to Create' Hub Channel", self, [discord.ChannelType.voice]))
         self.add_item(ChannelSelect("temp_vc_category_id", "Set Category for New VCs", self, [discord.ChannelType.category]))
 
+    @discord.ui.button(label="Set Channel Pool Size", style=discord.ButtonStyle.secondary, emoji="♨️", row=2)
+    async def set_pool_size(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(TempVCPoolModal())
+
+class TempVCPoolModal(discord.ui.Modal, title="Temp VC Channel Pool"):
+    def __init__(self):
+        super().__init__()
+        self.size_input = discord.ui.TextInput(label="Hidden channels to keep ready (0 = off)", placeholder="e.g., 3", min_length=1, max_length=2)
+        self.add_item(self.size_input)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            size = int(self.size_input.value); assert 0 <= size <= 10
+        except (ValueError, AssertionError):
+            return await interaction.response.send_message("Please enter a valid number between 0 and 10.", ephemeral=True)
+
+        await database.update_setting(interaction.guild.id, 'temp_vc_pool_size', size)
+        await interaction.response.send_message(f"✅ Temp VC channel pool size set to **{size}**.", ephemeral=True)
+
 class SubmissionsSettingsView(BaseSettingsView):
     def __init__(self, bot: commands.Bot, parent_view: SettingsMainView):
         super().__init__(bot, parent_view)
@@ -363,14 +376,15 @@ class SettingsMainView(BaseSettingsView):
 
     async def get_settings_embed(self, guild: discord.Guild):
         settings_data = await database.get_all_settings(guild.id)
+        admin_ids, mod_ids = await get_permission_roles(guild.id)
         embed = discord.Embed(title=f"Settings for {guild.name}", color=config.BOT_CONFIG["EMBED_COLORS"]["INFO"])
         def f_ch(k): return f"<#{settings_data.get(k)}>" if settings_data.get(k) else "Not Set"
         def f_rl(k): return f"<@&{settings_data.get(k)}>" if settings_data.get(k) else "Not Set"
-        def f_rls(k): return ", ".join([f"<@&{r}>" for r in (settings_data.get(k) or "").split(',') if r]) or "Not Set"
+        def f_rls(ids): return ", ".join([f"<@&{r}>" for r in ids]) or "Not Set"
         embed.add_field(name="General Channels", value=f"**Log:** {f_ch('log_channel_id')}\n**Report:** {f_ch('report_channel_id')}\n**Announce:** {f_ch('announcement_channel_id')}", inline=False)
-        embed.add_field(name="Role Permissions", value=f"**Admins:** {f_rls('admin_role_ids')}\n**Mods:** {f_rls('mod_role_ids')}", inline=False)
+        embed.add_field(name="Role Permissions", value=f"**Admins:** {f_rls(admin_ids)}\n**Mods:** {f_rls(mod_ids)}", inline=False)
         embed.add_field(name="Verification", value=f"**Mode:** `{settings_data.get('verification_mode', 'captcha').capitalize()}`\n**Channel:** {f_ch('verification_channel_id')}\n**Roles:** {f_rl('unverified_role_id')} -> {f_rl('member_role_id')}", inline=False)
-        embed.add_field(name="Temporary VCs", value=f"**Hub:** {f_ch('temp_vc_hub_id')}\n**Category:** {f_ch('temp_vc_category_id')}", inline=False)
+        embed.add_field(name="Temporary VCs", value=f"**Hub:** {f_ch('temp_vc_hub_id')}\n**Category:** {f_ch('temp_vc_category_id')}\n**Channel Pool:** `{settings_data.get('temp_vc_pool_size') or 0}`", inline=False)
         embed.add_field(name="Submissions", value=f"**Regular:** {f_ch('submission_channel_id')} -> {f_ch('review_channel_id')}\n**KOTH:** {f_ch('koth_submission_channel_id')} -> {f_rl('koth_winner_role_id')}", inline=False)
         return embed
 
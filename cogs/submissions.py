@@ -4,6 +4,7 @@ from discord.ext import commands
 import logging
 import asyncio
 from collections import defaultdict
+from typing import Literal
 
 import database
 import config
@@ -195,25 +196,14 @@ class SubmissionPanelView(discord.ui.View):
         self.add_item(button)
 
     async def _update_panel(self, interaction: discord.Interaction):
-        async with self.cog.panel_update_locks[interaction.guild.id]:
-            panel_message = await self.cog.get_panel_message(interaction.guild)
-            if panel_message:
-                embed, view = await get_panel_embed_and_view(interaction.guild, self.bot)
-                try:
-                    await panel_message.edit(embed=embed, view=view)
-                except discord.NotFound:
-                    log.warning(f"Failed to update panel for guild {interaction.guild.id}, message not found.")
+        await self.cog.update_panel(interaction.guild)
             
     # --- REGULAR MODE CALLBACKS ---
 
     async def start_submissions(self, interaction: discord.Interaction):
         if not await utils.has_admin_role(interaction.user): return await interaction.response.send_message("❌ Admins only.", ephemeral=True)
         await interaction.response.defer()
-        await database.update_setting(interaction.guild.id, 'submission_status', 'open')
-        await self._update_panel(interaction)
-        sub_channel_id = await database.get_setting(interaction.guild.id, 'submission_channel_id')
-        if sub_channel_id and (channel := self.bot.get_channel(sub_channel_id)):
-            await channel.send("@everyone Submissions are now **OPEN**! Please send your audio files here.")
+        await self.cog.open_regular_submissions(interaction.guild)
         await interaction.followup.send("✅ Submissions are now open.", ephemeral=True)
 
     async def play_queue(self, interaction: discord.Interaction):
@@ -230,19 +220,7 @@ class SubmissionPanelView(discord.ui.View):
     async def stop_submissions(self, interaction: discord.Interaction):
         if not await utils.has_admin_role(interaction.user): return await interaction.response.send_message("❌ Admins only.", ephemeral=True)
         await interaction.response.defer()
-        
-        conn = await database.get_db_connection()
-        async with conn.cursor() as cursor:
-            await cursor.execute("SELECT COUNT(*) FROM music_submissions WHERE guild_id = ? AND submission_type = ? AND status = 'reviewed'", (interaction.guild.id, 'regular'))
-            session_reviewed_count = (await cursor.fetchone())[0]
-
-        await database.clear_session_submissions(interaction.guild.id, 'regular')
-        await database.update_setting(interaction.guild.id, 'submission_status', 'closed')
-        await self._update_panel(interaction)
-        
-        sub_channel_id = await database.get_setting(interaction.guild.id, 'submission_channel_id')
-        if sub_channel_id and (channel := self.bot.get_channel(sub_channel_id)):
-            await channel.send("Submissions are now **CLOSED**! Thanks to everyone who sent in their tracks.")
+        session_reviewed_count = await self.cog.close_regular_submissions(interaction.guild)
         await interaction.followup.send(f"✅ Session closed. A total of **{session_reviewed_count}** tracks were reviewed in this session.", ephemeral=True)
 
     async def statistics(self, interaction: discord.Interaction):
@@ -384,6 +362,9 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
         self.current_koth_session = defaultdict(dict)
         self.tiebreaker_submissions = defaultdict(dict)
 
+    async def cog_load(self):
+        self.bot.scheduler.register("submissions.set_status", self.run_scheduled_status_change)
+
     async def _broadcast_full_update(self, guild_id: int):
         """Helper to construct and broadcast a full widget update."""
         if hasattr(self.bot, 'app') and hasattr(self.bot.app, 'ws_manager'):
@@ -455,6 +436,51 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
         else:
             await interaction.response.send_message("✅ KOTH battle stopped. Results posted.", ephemeral=True)
 
+    async def update_panel(self, guild: discord.Guild):
+        async with self.panel_update_locks[guild.id]:
+            panel_message = await self.get_panel_message(guild)
+            if panel_message:
+                embed, view = await get_panel_embed_and_view(guild, self.bot)
+                try:
+                    await panel_message.edit(embed=embed, view=view)
+                except discord.NotFound:
+                    log.warning(f"Failed to update panel for guild {guild.id}, message not found.")
+
+    async def open_regular_submissions(self, guild: discord.Guild):
+        await database.update_setting(guild.id, 'submission_status', 'open')
+        await self.update_panel(guild)
+        sub_channel_id = await database.get_setting(guild.id, 'submission_channel_id')
+        if sub_channel_id and (channel := self.bot.get_channel(sub_channel_id)):
+            await channel.send("@everyone Submissions are now **OPEN**! Please send your audio files here.")
+
+    async def close_regular_submissions(self, guild: discord.Guild) -> int:
+        """Closes the regular session and returns how many tracks were reviewed in it."""
+        conn = await database.get_db_connection()
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT COUNT(*) FROM music_submissions WHERE guild_id = ? AND submission_type = ? AND status = 'reviewed'", (guild.id, 'regular'))
+            session_reviewed_count = (await cursor.fetchone())[0]
+
+        await database.clear_session_submissions(guild.id, 'regular')
+        await database.update_setting(guild.id, 'submission_status', 'closed')
+        await self.update_panel(guild)
+        
+        sub_channel_id = await database.get_setting(guild.id, 'submission_channel_id')
+        if sub_channel_id and (channel := self.bot.get_channel(sub_channel_id)):
+            await channel.send("Submissions are now **CLOSED**! Thanks to everyone who sent in their tracks.")
+        return session_reviewed_count
+
+    async def run_scheduled_status_change(self, payload: dict):
+        """Scheduler handler for `/schedule_submissions`. Does nothing if the panel was switched by hand meanwhile."""
+        guild = self.bot.get_guild(payload["guild_id"])
+        if not guild or not await database.get_setting(guild.id, 'submissions_system_enabled'):
+            return
+        status = await database.get_setting(guild.id, 'submission_status') or 'closed'
+        if payload["action"] == "open" and status == 'closed':
+            await self.open_regular_submissions(guild)
+        elif payload["action"] == "close" and status == 'open':
+            reviewed = await self.close_regular_submissions(guild)
+            log.info(f"Scheduled close of submissions in guild {guild.id}; {reviewed} tracks were reviewed.")
+
     async def get_panel_message(self, guild: discord.Guild) -> discord.Message | None:
         panel_id = await database.get_setting(guild.id, 'review_panel_message_id')
         channel_id = await database.get_setting(guild.id, 'review_channel_id')
@@ -564,6 +590,18 @@ class SubmissionsCog(commands.Cog, name="Submissions"):
             embed, view = await get_panel_embed_and_view(interaction.guild, self.bot)
             await panel_message.edit(embed=embed, view=view)
 
+    @app_commands.command(name="schedule_submissions", description="Opens or closes regular submissions automatically after a delay.")
+    @utils.is_bot_admin()
+    @app_commands.describe(action="Whether to open or close submissions.", minutes="How many minutes from now (0 cancels a pending schedule).")
+    async def schedule_submissions(self, interaction: discord.Interaction, action: Literal["open", "close"], minutes: app_commands.Range[int, 0, 10080]):
+        key = f"submissions:{interaction.guild.id}"
+        if minutes == 0:
+            await self.bot.scheduler.cancel_key(key)
+            return await interaction.response.send_message("✅ Cancelled any scheduled submission change.", ephemeral=True)
+        await self.bot.scheduler.schedule("submissions.set_status", delay=minutes * 60, payload={"guild_id": interaction.guild.id, "action": action}, key=key)
+        run_at = int(discord.utils.utcnow().timestamp()) + minutes * 60
+        await interaction.response.send_message(f"✅ Submissions will **{action}** <t:{run_at}:R>. This replaces any earlier schedule.", ephemeral=True)
+
     @app_commands.command(name="setup_submission_panel", description="Posts the interactive panel for managing music submissions.")
     @utils.is_bot_admin()
     async def setup_submission_panel(self, interaction: discord.Interaction):
@@ -1,65 +1,224 @@
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 import logging
-import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
+import math
 import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
+import backup
 import database 
+import metrics
+from scheduler import CATCH_UP_SKIP
 
 log = logging.getLogger(__name__)
 
+SWEEP_BATCH_SIZE = 500
+BACKUP_DIR = "BackUps"
+EXPORT_WORKERS = 2
+DAILY_BACKUP_JITTER_SECONDS = 600
+SHARD_METRICS_SECONDS = 60
+# The guild an event belongs to decides its shard; payloads without one (DMs, READY) go to shard 0.
+GUILD_ID_RE = re.compile(r'"guild_id":\s*"(\d+)"')
+
 class TasksCog(commands.Cog, name="Background Tasks"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.daily_backup.start()
+        # Exports get their own threads so a long one never ties up the default executor.
+        self.export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="backup-export")
+        self.backup_lock = asyncio.Lock() # Bases, incrementals and restores never overlap
+        self.shard_events = Counter() # shard_id -> dispatched events since the last metrics tick
+        self.expired_rows_sweeper.start()
+        self.shard_metrics.start()
+
+    async def cog_load(self):
+        scheduler = self.bot.scheduler
+        scheduler.register("backup.daily", self.daily_backup)
+        scheduler.register("backup.incremental", self.hourly_incremental_backup)
+        # replace=False keeps the persisted schedule across restarts instead of resetting it.
+        await scheduler.schedule("backup.daily", interval=24 * 3600, jitter=DAILY_BACKUP_JITTER_SECONDS, key="backup.daily", replace=False)
+        await scheduler.schedule("backup.incremental", delay=3600, interval=3600, catch_up=CATCH_UP_SKIP, key="backup.incremental", replace=False)
 
     def cog_unload(self):
-        self.daily_backup.cancel()
-
-    @tasks.loop(hours=24)
-    async def daily_backup(self):
-        # Ensure the main backup directory exists
-        if not os.path.exists("BackUps"):
-            os.makedirs("BackUps")
-            
+        self.expired_rows_sweeper.cancel()
+        self.shard_metrics.cancel()
+        self.export_executor.shutdown(wait=False)
+
+    @tasks.loop(minutes=10)
+    async def expired_rows_sweeper(self):
+        """Deletes expired OAuth states and Gmail codes in small batches, then reports table sizes."""
+        for table in database.EXPIRING_TABLES:
+            total_deleted = 0
+            while True:
+                deleted = await database.delete_expired_rows(table, SWEEP_BATCH_SIZE)
+                total_deleted += deleted
+                if deleted < SWEEP_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0.1) # Let other writers in between batches
+            row_count = await database.get_table_row_count(table)
+            metrics.incr(f"sweeper.{table}.deleted", total_deleted)
+            metrics.set_gauge(f"db.{table}.rows", row_count)
+            if total_deleted:
+                log.info(f"Swept {total_deleted} expired rows from {table} ({row_count} remaining).")
+
+    @expired_rows_sweeper.before_loop
+    async def before_expired_rows_sweeper(self):
+        await self.bot.wait_until_ready()
+
+    # --- SHARD METRICS ---
+    @commands.Cog.listener()
+    async def on_socket_event_type(self, event_type: str):
+        metrics.incr(f"gateway.events.{event_type}")
+
+    @commands.Cog.listener()
+    async def on_socket_raw_receive(self, payload: str):
+        """Attributes each dispatched event to a shard (needs enable_debug_events)."""
+        if '"op":0' not in payload:
+            return # Heartbeat ACKs, hellos and other non-dispatch frames
+        match = GUILD_ID_RE.search(payload)
+        self.shard_events[(int(match[1]) >> 22) % self.bot.shard_count if match else 0] += 1
+
+    @tasks.loop(seconds=SHARD_METRICS_SECONDS)
+    async def shard_metrics(self):
+        """Reports latency, guild count and event rate for every shard this process runs."""
+        guild_counts = Counter(guild.shard_id for guild in self.bot.guilds)
+        for shard_id, shard in self.bot.shards.items():
+            prefix = f"shard.{shard_id}"
+            connected = not shard.is_closed()
+            metrics.set_gauge(f"{prefix}.connected", connected)
+            metrics.set_gauge(f"{prefix}.guilds", guild_counts.get(shard_id, 0))
+            metrics.set_gauge(f"{prefix}.latency_ms", round(shard.latency * 1000, 1) if math.isfinite(shard.latency) else None)
+            metrics.set_gauge(f"{prefix}.events_per_second", round(self.shard_events.pop(shard_id, 0) / SHARD_METRICS_SECONDS, 2))
+
+    @shard_metrics.before_loop
+    async def before_shard_metrics(self):
+        await self.bot.wait_until_ready()
+
+    # --- BACKUPS ---
+    async def _take_snapshot(self):
+        """Snapshots the live database into a new chain directory. Returns (timestamp, chain_dir, snapshot_path)."""
+        created_at = datetime.now()
+        # Chains are named by the second; step past any chain taken in the same second.
+        while os.path.exists(backup.chain_path(BACKUP_DIR, created_at.strftime(backup.TIMESTAMP_FORMAT))):
+            created_at += timedelta(seconds=1)
+        timestamp = created_at.strftime(backup.TIMESTAMP_FORMAT)
+        chain_dir = backup.chain_path(BACKUP_DIR, timestamp)
+        os.makedirs(chain_dir, exist_ok=True)
+        snapshot_path = f"{chain_dir}/base.db"
+        with metrics.timer("backup.snapshot"):
+            pages = await asyncio.to_thread(backup.snapshot_database, database.DB_FILE, snapshot_path)
+        log.info(f"Database snapshot written to {snapshot_path} ({pages} pages).")
+        return timestamp, chain_dir, snapshot_path
+
+    async def _finish_chain(self, chain_dir: str, snapshot_path: str):
+        base_change_id = await asyncio.to_thread(backup.start_chain, chain_dir, snapshot_path)
+        # The base already holds every change logged so far.
+        await database.trim_change_log(base_change_id)
+
+    async def daily_backup(self, payload: dict):
         log.info("Starting daily server data backup...")
-        
-        for guild in self.bot.guilds:
-            backup_data = {}
-            
-            # Fetch all settings and data for the guild
-            # For a complete backup, you would fetch from every relevant table
-            backup_data['guild_settings'] = await database.get_all_settings(guild.id)
-            backup_data['koth_leaderboard'] = await database.get_koth_leaderboard(guild.id)
-            backup_data['ranking_leaderboard'] = await database.get_leaderboard(guild.id, limit=999)
-            # You could add more fetches for warnings, reaction roles, etc.
-            
-            # Sanitize the guild name to remove characters that are illegal in folder names
-            sanitized_name = re.sub(r'[\\/*?:"<>|]', "", guild.name)
-            guild_dir = f"BackUps/{sanitized_name.replace(' ', '_')}_{guild.id}"
-            
-            if not os.path.exists(guild_dir):
-                os.makedirs(guild_dir)
-            
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            file_path = f"{guild_dir}/{sanitized_name.replace(' ', '_')}_{timestamp}_backup.json"
-            
+        async with self.backup_lock:
+            try:
+                timestamp, chain_dir, snapshot_path = await self._take_snapshot()
+            except Exception as e:
+                log.error(f"Failed to snapshot the database: {e}")
+                return
+
+            semaphore = asyncio.Semaphore(EXPORT_WORKERS) # Keeps exports queued here, not in the executor
+            await asyncio.gather(*(self._export_guild(guild, timestamp, snapshot_path, semaphore) for guild in self.bot.guilds))
+
+            try:
+                await self._finish_chain(chain_dir, snapshot_path)
+                removed = await asyncio.to_thread(backup.prune_backups, BACKUP_DIR)
+                metrics.incr("backup.pruned", removed)
+                log.info(f"Started backup chain {timestamp}; pruned {removed} old backup files.")
+            except Exception as e:
+                log.error(f"Failed to finish backup chain {timestamp}: {e}")
+
+    async def _export_guild(self, guild: discord.Guild, timestamp: str, snapshot_path: str, semaphore: asyncio.Semaphore):
+        # Sanitize the guild name to remove characters that are illegal in folder names
+        sanitized_name = re.sub(r'[\\/*?:"<>|]', "", guild.name).replace(' ', '_')
+        guild_dir = f"{BACKUP_DIR}/{sanitized_name}_{guild.id}"
+        file_path = f"{guild_dir}/{sanitized_name}_{timestamp}_backup.json"
+
+        async with semaphore:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    # A custom converter is needed to handle discord.py objects if you back them up directly
-                    # For simple data from the DB, this is fine.
-                    json.dump(backup_data, f, ensure_ascii=False, indent=4)
-                log.info(f"Successfully backed up data for guild: {guild.name} ({guild.id})")
+                os.makedirs(guild_dir, exist_ok=True)
+                with metrics.timer("backup.guild_export"):
+                    rows = await asyncio.get_running_loop().run_in_executor(self.export_executor, backup.export_guild, snapshot_path, guild.id, file_path)
+                log.info(f"Successfully backed up data for guild: {guild.name} ({guild.id}), {rows} rows.")
             except Exception as e:
                 log.error(f"Failed to write backup for guild {guild.name}: {e}")
 
-    @daily_backup.before_loop
-    async def before_daily_backup(self):
-        await self.bot.wait_until_ready()
-        log.info("Backup task is ready.")
+    async def hourly_incremental_backup(self, payload: dict):
+        """Appends the rows changed since the last backup to the newest chain."""
+        async with self.backup_lock:
+            chains = backup.list_chains(BACKUP_DIR)
+            if not chains:
+                return # The daily backup starts the first chain
+            chain_dir = backup.chain_path(BACKUP_DIR, chains[-1])
+            try:
+                with metrics.timer("backup.incremental"):
+                    to_change_id, rows = await asyncio.to_thread(backup.write_incremental, chain_dir, database.DB_FILE)
+                await database.trim_change_log(to_change_id)
+                metrics.incr("backup.incremental_rows", rows)
+                if rows:
+                    log.info(f"Incremental backup wrote {rows} changed rows to chain {chains[-1]}.")
+            except Exception as e:
+                log.error(f"Incremental backup failed: {e}")
+
+    backup_group = app_commands.Group(name="backup", description="Manage database backups.")
+
+    @backup_group.command(name="restore", description="Restore the database from a backup chain (bot owner only).")
+    @app_commands.describe(chain="The backup chain to restore, named after its base snapshot time.", until="Only replay incrementals up to this time (YYYY-MM-DD_HH-MM-SS). Defaults to the latest.")
+    async def backup_restore(self, interaction: discord.Interaction, chain: str, until: str = None):
+        if not await self.bot.is_owner(interaction.user):
+            return await interaction.response.send_message("Only the bot owner can restore backups.", ephemeral=True)
+        if chain not in backup.list_chains(BACKUP_DIR):
+            return await interaction.response.send_message("❌ No backup chain with that name.", ephemeral=True)
+        if until:
+            try:
+                datetime.strptime(until, backup.TIMESTAMP_FORMAT)
+            except ValueError:
+                return await interaction.response.send_message("❌ `until` must look like `2024-01-31_18-00-00`.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        async with self.backup_lock:
+            chain_dir = backup.chain_path(BACKUP_DIR, chain)
+            restored_path = f"{chain_dir}/restore.db"
+            try:
+                replayed = await asyncio.to_thread(backup.build_restore, chain_dir, restored_path, until)
+                # Keep the current state as its own chain so the restore can be undone.
+                _, safety_dir, safety_snapshot = await self._take_snapshot()
+                await self._finish_chain(safety_dir, safety_snapshot)
+                await asyncio.to_thread(backup.snapshot_database, restored_path, database.DB_FILE)
+                # Start a fresh chain so later incrementals build on the restored data.
+                _, new_dir, new_snapshot = await self._take_snapshot()
+                await self._finish_chain(new_dir, new_snapshot)
+            except Exception as e:
+                log.error(f"Restoring backup chain {chain} failed: {e}")
+                return await interaction.followup.send(f"❌ Restore failed: {e}", ephemeral=True)
+            finally:
+                if os.path.exists(restored_path):
+                    os.remove(restored_path)
+
+        database.notify_database_restored()
+        log.warning(f"Database restored from chain {chain} ({replayed} incrementals) by {interaction.user.id}.")
+        await interaction.followup.send(
+            f"✅ Restored chain `{chain}` with {replayed} incremental(s) replayed. The previous state was saved as chain `{os.path.basename(safety_dir)}`.\n"
+            "Settings, bad word, rank reward, permission role and leaderboard caches were refreshed; "
+            "restart the bot so the temp VC, reaction role and scheduled job registries reload too.",
+            ephemeral=True
+        )
+
+    @backup_restore.autocomplete("chain")
+    async def backup_chain_autocomplete(self, interaction: discord.Interaction, current: str):
+        chains = [name for name in reversed(backup.list_chains(BACKUP_DIR)) if current in name]
+        return [app_commands.Choice(name=name, value=name) for name in chains[:25]]
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(TasksCog(bot))
\ No newline at end of file
@@ -1,19 +1,33 @@
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+import asyncio
 import logging
+import time
+from datetime import timedelta
 from typing import Union
 
 import database
 import config 
+import metrics
 import utils
 
 log = logging.getLogger(__name__)
 
+HUB_SETTINGS_TTL_SECONDS = 600 # Safety net only; setting_changed events drop stale entries straight away
+HUB_SETTING_NAMES = ('temp_vc_system_enabled', 'temp_vc_hub_id', 'temp_vc_category_id')
+RECONCILE_CONCURRENCY = 5 # Channel deletions in flight at once during a sweep
+RECONCILE_GRACE_SECONDS = 30 # Skip channels this new; their owner may still be being moved in
+POOL_MAX_SIZE = 10
+POOL_REFILL_DELAY_SECONDS = 2 # Spacing between pool channel creations to stay clear of rate limits
+POOL_CHANNEL_NAME = "Spare Room"
+QUEUE_FEEDBACK_SECONDS = 15 # How long the "your room is on its way" notice stays in the hub chat
+
 # --- View for claiming ownership ---
 class ClaimOwnershipView(discord.ui.View):
-    def __init__(self, channel: discord.VoiceChannel):
+    def __init__(self, cog: "TempVCCog", channel: discord.VoiceChannel):
         super().__init__(timeout=120) # 2 minute timeout
+        self.cog = cog
         self.channel = channel
         self.message = None
 
@@ -22,9 +36,11 @@ class ClaimOwnershipView(discord.ui.View):
         # Check if the user is in the voice channel
         if not interaction.user.voice or interaction.user.voice.channel != self.channel:
             return await interaction.response.send_message("You must be in the voice channel to claim it.", ephemeral=True)
+        if self.cog.temp_vcs.get(self.channel.id) != 0:
+            return await interaction.response.send_message("This channel has already been claimed.", ephemeral=True)
             
-        # Update the owner in the database to the new user
-        await database.update_temp_vc_owner(self.channel.id, interaction.user.id)
+        # Update the owner in the registry and database to the new user
+        await self.cog.set_owner(self.channel.id, interaction.user.id)
         
         # Give the new owner channel management permissions
         await self.channel.set_permissions(interaction.user, manage_channels=True, move_members=True)
@@ -44,78 +60,323 @@ class ClaimOwnershipView(discord.ui.View):
 class TempVCCog(commands.Cog, name="Temp VCs"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.temp_vcs: dict[int, int] = {} # channel_id -> owner_id (0 while ownerless)
+        self.hub_settings: dict[int, tuple] = {} # guild_id -> (expires_at, enabled, hub_id, category_id)
+        self.reconcile_lock = asyncio.Lock()
+        self.channel_pool: dict[int, list[int]] = {} # guild_id -> hidden pre-created channel ids
+        self.pool_refills: dict[int, asyncio.Task] = {}
+        # channel_id -> time.monotonic() of the claim. Pooled channels are old, so their created_at
+        # can't tell reconciliation that the owner is still being moved in.
+        self.pool_claims: dict[int, float] = {}
+        self.creation_queues: dict[int, asyncio.Queue] = {} # guild_id -> (member_id, joined_at) in join order
+        self.creation_workers: dict[int, asyncio.Task] = {}
+        self.queued_members: dict[int, set[int]] = {}
+        self.busy_guilds: set[int] = set()
 
-    async def cog_check(self, interaction: discord.Interaction) -> bool:
-        """Checks if the Temp VC system is enabled for this guild."""
-        is_enabled = await database.get_setting(interaction.guild.id, 'temp_vc_system_enabled')
-        if not is_enabled:
-            await interaction.response.send_message("The temporary voice channel system is disabled on this server.", ephemeral=True)
-            return False
-        return True
+    async def cog_load(self):
+        self.temp_vcs = await database.get_all_temp_vcs()
+        self.channel_pool = await database.get_temp_vc_pool()
+        log.info(f"Loaded {len(self.temp_vcs)} temporary VCs into the registry.")
+        database.subscribe(database.EVENT_SETTING_CHANGED, self.on_setting_changed)
+        database.subscribe(database.EVENT_DATABASE_RESTORED, self.hub_settings.clear)
+        self.reconcile_loop.start()
 
-    @commands.Cog.listener()
-    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-        if member.bot:
+    def cog_unload(self):
+        database.unsubscribe(database.EVENT_SETTING_CHANGED, self.on_setting_changed)
+        database.unsubscribe(database.EVENT_DATABASE_RESTORED, self.hub_settings.clear)
+        self.reconcile_loop.cancel()
+        for task in [*self.pool_refills.values(), *self.creation_workers.values()]:
+            task.cancel()
+
+    # --- PRE-WARMED CHANNEL POOL ---
+    def schedule_pool_refill(self, guild: discord.Guild):
+        """Starts a background refill for the guild unless one is already running."""
+        task = self.pool_refills.get(guild.id)
+        if task and not task.done():
             return
-        
-        if not await database.get_setting(member.guild.id, 'temp_vc_system_enabled'):
+        self.pool_refills[guild.id] = asyncio.create_task(self._refill_pool(guild))
+
+    async def _refill_pool(self, guild: discord.Guild):
+        """Tops the guild's pool up to its configured size, or trims it, one channel at a time."""
+        enabled, _, category_id = await self.get_hub_settings(guild.id)
+        size = min(await database.get_setting(guild.id, 'temp_vc_pool_size') or 0, POOL_MAX_SIZE) if enabled else 0
+        category = guild.get_channel(category_id) if category_id else None
+        pool = self.channel_pool.setdefault(guild.id, [])
+
+        # Forget channels that were deleted by hand while pooled.
+        for channel_id in [channel_id for channel_id in pool if not guild.get_channel(channel_id)]:
+            pool.remove(channel_id)
+            await database.remove_pooled_temp_vc(channel_id)
+
+        try:
+            while len(pool) > size:
+                channel_id = pool.pop()
+                await database.remove_pooled_temp_vc(channel_id)
+                await guild.get_channel(channel_id).delete(reason="Temporary VC pool shrunk.")
+            while category and len(pool) < size:
+                overwrites = {
+                    guild.default_role: discord.PermissionOverwrite(view_channel=False, connect=False),
+                    guild.me: discord.PermissionOverwrite(view_channel=True, connect=True, manage_channels=True, move_members=True)
+                }
+                channel = await guild.create_voice_channel(name=POOL_CHANNEL_NAME, category=category, overwrites=overwrites, bitrate=64000, reason="Pre-warming temporary VC pool")
+                pool.append(channel.id)
+                await database.add_pooled_temp_vc(channel.id, guild.id)
+                await asyncio.sleep(POOL_REFILL_DELAY_SECONDS)
+        except discord.Forbidden:
+            log.error(f"Failed to refill temp VC pool in guild {guild.id}. Missing permissions.")
+        except discord.HTTPException as e:
+            log.error(f"An error occurred refilling the temp VC pool in guild {guild.id}: {e}")
+        metrics.set_gauge("temp_vc.pooled", sum(len(channels) for channels in self.channel_pool.values()))
+
+    async def _take_pooled_channel(self, member: discord.Member, category: discord.CategoryChannel, overwrites: dict):
+        """Turns a hidden pool channel into the member's room. Returns None if the pool is empty."""
+        pool = self.channel_pool.get(member.guild.id)
+        while pool:
+            channel = member.guild.get_channel(pool.pop(0))
+            if channel is None:
+                continue
+            # Keep the bot's own overwrite; dropping the @everyone deny is what unhides the channel.
+            merged = {target: overwrite for target, overwrite in channel.overwrites.items() if target != member.guild.default_role}
+            merged.update(overwrites)
+            try:
+                await channel.edit(name=f"{member.display_name}'s Room", category=category, overwrites=merged, reason=f"Temporary channel claimed from pool by {member}")
+            except discord.NotFound:
+                continue
+            except discord.HTTPException as e:
+                log.warning(f"Could not take pooled VC {channel.id} in guild {member.guild.id}: {e}")
+                pool.insert(0, channel.id)
+                return None
+            self.temp_vcs[channel.id] = member.id
+            self.pool_claims[channel.id] = time.monotonic()
+            await database.claim_pooled_temp_vc(channel.id, member.id)
+            metrics.incr("temp_vc.pool_hits")
+            return channel
+        metrics.incr("temp_vc.pool_misses")
+        return None
+
+    # --- ORPHAN RECONCILIATION ---
+    async def _reconcile_channel(self, channel_id: int, semaphore: asyncio.Semaphore):
+        """Returns 'missing', 'deleted' or None (channel still in use or state unknown)."""
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            # Not in cache; only treat the channel as gone once Discord confirms it.
+            try:
+                channel = await self.bot.fetch_channel(channel_id)
+            except (discord.NotFound, discord.Forbidden):
+                return 'missing' # Gone, or we lost access to it; either way we can never clean it up
+            except discord.HTTPException as e:
+                log.warning(f"Could not check temporary VC {channel_id} during reconciliation: {e}")
+                return None
+        if not isinstance(channel, discord.VoiceChannel) or channel.members:
+            return None
+        if not utils.is_shard_connected(self.bot, channel.guild.shard_id):
+            return None # The shard's voice state is stale; an "empty" channel may not be
+        if discord.utils.utcnow() - channel.created_at < timedelta(seconds=RECONCILE_GRACE_SECONDS):
+            return None
+        if time.monotonic() - self.pool_claims.get(channel_id, float("-inf")) < RECONCILE_GRACE_SECONDS:
+            return None
+        async with semaphore:
+            try:
+                await channel.delete(reason="Temporary channel empty (reconciliation).")
+            except discord.NotFound:
+                return 'missing'
+            except discord.Forbidden:
+                log.warning(f"Missing permission to delete orphaned temporary VC {channel_id}; dropping it from the registry.")
+                return 'missing'
+            except discord.HTTPException as e:
+                log.error(f"Failed to delete orphaned temporary VC {channel_id}: {e}")
+                return None
+        return 'deleted'
+
+    async def reconcile_temp_vcs(self):
+        """Diffs the registry against live channels: deletes temp VCs that emptied while the
+        bot was away and drops rows whose channel no longer exists, in one statement."""
+        if self.reconcile_lock.locked():
             return
+        async with self.reconcile_lock:
+            semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+            channel_ids = list(self.temp_vcs)
+            results = await asyncio.gather(*(self._reconcile_channel(channel_id, semaphore) for channel_id in channel_ids))
+            stale = [channel_id for channel_id, result in zip(channel_ids, results) if result]
+            for channel_id in stale:
+                self.temp_vcs.pop(channel_id, None)
+                self.pool_claims.pop(channel_id, None)
+            await database.remove_temp_vcs(stale)
 
-        hub_channel_id = await database.get_setting(member.guild.id, 'temp_vc_hub_id')
-        category_id = await database.get_setting(member.guild.id, 'temp_vc_category_id')
+            deleted = results.count('deleted')
+            missing = results.count('missing')
+            metrics.incr("temp_vc.reconcile_deleted", deleted)
+            metrics.incr("temp_vc.reconcile_missing", missing)
+            metrics.set_gauge("temp_vc.registered", len(self.temp_vcs))
+            if stale:
+                log.info(f"Temp VC reconciliation: deleted {deleted} empty channels, removed {missing} rows for missing channels.")
 
-        # --- CHANNEL CREATION LOGIC ---
-        if after.channel and after.channel.id == hub_channel_id:
-            category = member.guild.get_channel(category_id) if category_id else None
-            if not category:
-                log.warning(f"User {member} joined hub VC in guild {member.guild.id}, but no category is configured.")
-                return
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.reconcile_temp_vcs()
+        for guild in self.bot.guilds:
+            self.schedule_pool_refill(guild)
+
+    @tasks.loop(minutes=30)
+    async def reconcile_loop(self):
+        await self.reconcile_temp_vcs()
 
-            overwrites = {
-                member: discord.PermissionOverwrite(connect=True, manage_channels=True, move_members=True, view_channel=True)
-            }
+    @reconcile_loop.before_loop
+    async def before_reconcile_loop(self):
+        await self.bot.wait_until_ready()
 
+    def on_setting_changed(self, guild_id: int, setting_name: str, value):
+        if setting_name in HUB_SETTING_NAMES:
+            self.hub_settings.pop(guild_id, None)
+        if setting_name in HUB_SETTING_NAMES or setting_name == 'temp_vc_pool_size':
+            if guild := self.bot.get_guild(guild_id):
+                self.schedule_pool_refill(guild)
+
+    async def get_hub_settings(self, guild_id: int):
+        """Returns (enabled, hub_id, category_id), re-reading the database at most once per TTL."""
+        cached = self.hub_settings.get(guild_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1:]
+        enabled = await database.get_setting(guild_id, 'temp_vc_system_enabled')
+        hub_id = await database.get_setting(guild_id, 'temp_vc_hub_id')
+        category_id = await database.get_setting(guild_id, 'temp_vc_category_id')
+        self.hub_settings[guild_id] = (time.monotonic() + HUB_SETTINGS_TTL_SECONDS, enabled, hub_id, category_id)
+        return enabled, hub_id, category_id
+
+    async def set_owner(self, channel_id: int, owner_id: int):
+        """Records a new owner, skipping the database write if nothing changed."""
+        if self.temp_vcs.get(channel_id) == owner_id:
+            return
+        self.temp_vcs[channel_id] = owner_id
+        await database.update_temp_vc_owner(channel_id, owner_id)
+
+    async def forget_channel(self, channel_id: int):
+        self.pool_claims.pop(channel_id, None)
+        if self.temp_vcs.pop(channel_id, None) is not None:
+            await database.remove_temp_vc(channel_id)
+
+    # --- CREATION QUEUE ---
+    async def enqueue_creation(self, member: discord.Member, hub_channel: discord.VoiceChannel):
+        """Queues a room for the member behind anyone who joined the hub first. Members
+        already waiting are not queued twice."""
+        guild_id = member.guild.id
+        queued = self.queued_members.setdefault(guild_id, set())
+        if member.id in queued:
+            metrics.incr("temp_vc.queue_deduplicated")
+            return
+        queue = self.creation_queues.setdefault(guild_id, asyncio.Queue())
+        worker = self.creation_workers.get(guild_id)
+        if not worker or worker.done():
+            self.creation_workers[guild_id] = asyncio.create_task(self._creation_worker(member.guild))
+
+        queued.add(member.id)
+        queue.put_nowait((member.id, time.perf_counter()))
+        metrics.set_gauge("temp_vc.creation_queue_depth", sum(q.qsize() for q in self.creation_queues.values()))
+
+        ahead = queue.qsize() - 1 + (1 if guild_id in self.busy_guilds else 0)
+        if ahead > 0:
             try:
+                await hub_channel.send(f"⏳ {member.mention}, your room is on its way ({ahead} ahead of you). Please stay in this channel.", delete_after=QUEUE_FEEDBACK_SECONDS)
+            except discord.HTTPException:
+                pass
+
+    async def _creation_worker(self, guild: discord.Guild):
+        """Creates rooms for one guild strictly in join order, one at a time, so a join
+        storm queues up here instead of colliding on the channel-create rate limit."""
+        queue = self.creation_queues[guild.id]
+        while True:
+            member_id, joined_at = await queue.get()
+            self.queued_members[guild.id].discard(member_id)
+            self.busy_guilds.add(guild.id)
+            try:
+                enabled, hub_channel_id, category_id = await self.get_hub_settings(guild.id)
+                member = guild.get_member(member_id)
+                # Skip anyone who gave up and left the hub while waiting.
+                if not enabled or not member or not member.voice or not member.voice.channel or member.voice.channel.id != hub_channel_id:
+                    metrics.incr("temp_vc.queue_abandoned")
+                    continue
+                category = guild.get_channel(category_id) if category_id else None
+                if not category:
+                    log.warning(f"User {member} joined hub VC in guild {guild.id}, but no category is configured.")
+                    continue
+                await self._create_room(member, category, joined_at)
+            finally:
+                self.busy_guilds.discard(guild.id)
+                metrics.set_gauge("temp_vc.creation_queue_depth", sum(q.qsize() for q in self.creation_queues.values()))
+
+    async def _create_room(self, member: discord.Member, category: discord.CategoryChannel, joined_at: float):
+        overwrites = {
+            member: discord.PermissionOverwrite(connect=True, manage_channels=True, move_members=True, view_channel=True)
+        }
+
+        try:
+            new_channel = await self._take_pooled_channel(member, category, overwrites)
+            if new_channel:
+                self.schedule_pool_refill(member.guild)
+            else:
                 # Set a bitrate that's reasonable, e.g., 64kbps
-                new_channel = await member.guild.create_voice_channel(
+                new_channel = await utils.call_with_rate_limit_retry(lambda: member.guild.create_voice_channel(
                     name=f"{member.display_name}'s Room",
                     category=category,
                     overwrites=overwrites,
                     bitrate=64000,
                     reason=f"Temporary channel created by {member}"
-                )
-                await member.move_to(new_channel)
+                ))
+                # Register before moving so a quick leave is already recognised as a temp VC.
+                self.temp_vcs[new_channel.id] = member.id
                 await database.add_temp_vc(new_channel.id, member.id)
-                log.info(f"Created temporary VC {new_channel.id} for member {member.id}.")
-
-                guide_embed = discord.Embed(
-                    title="🔒 Your Private Voice Channel",
-                    description=f"Welcome, {member.mention}! You are the owner of this channel.\nUse these commands in any text channel to manage it:",
-                    color=config.BOT_CONFIG["EMBED_COLORS"]["INFO"]
-                )
-                guide_embed.add_field(name="`/vc lock` / `/vc unlock`", value="Lock or unlock the channel.", inline=True)
-                guide_embed.add_field(name="`/vc rename <name>`", value="Change the channel name.", inline=True)
-                guide_embed.add_field(name="`/vc limit <number>`", value="Set a user limit (0=inf).", inline=True)
-                guide_embed.add_field(name="`/vc permit <user/role>`", value="Allow a user/role to join.", inline=False)
-                guide_embed.add_field(name="`/vc deny <user/role>`", value="Block a user/role from joining.", inline=False)
-                guide_embed.set_footer(text="This channel will be deleted when everyone leaves.")
-                
-                # Try sending the guide message, but don't fail if permissions are missing
-                try:
-                    await new_channel.send(embed=guide_embed)
-                except discord.Forbidden:
-                    log.warning(f"Could not send guide to new temp VC {new_channel.id}. Missing Send Messages permission.")
+            await utils.call_with_rate_limit_retry(lambda: member.move_to(new_channel))
+            metrics.observe("temp_vc.hub_join_to_move", time.perf_counter() - joined_at)
+            log.info(f"Created temporary VC {new_channel.id} for member {member.id}.")
 
+            guide_embed = discord.Embed(
+                title="🔒 Your Private Voice Channel",
+                description=f"Welcome, {member.mention}! You are the owner of this channel.\nUse these commands in any text channel to manage it:",
+                color=config.BOT_CONFIG["EMBED_COLORS"]["INFO"]
+            )
+            guide_embed.add_field(name="`/vc lock` / `/vc unlock`", value="Lock or unlock the channel.", inline=True)
+            guide_embed.add_field(name="`/vc rename <name>`", value="Change the channel name.", inline=True)
+            guide_embed.add_field(name="`/vc limit <number>`", value="Set a user limit (0=inf).", inline=True)
+            guide_embed.add_field(name="`/vc permit <user/role>`", value="Allow a user/role to join.", inline=False)
+            guide_embed.add_field(name="`/vc deny <user/role>`", value="Block a user/role from joining.", inline=False)
+            guide_embed.set_footer(text="This channel will be deleted when everyone leaves.")
+            
+            # Try sending the guide message, but don't fail if permissions are missing
+            try:
+                await new_channel.send(embed=guide_embed)
             except discord.Forbidden:
-                log.error(f"Failed to create/move member to temp VC in guild {member.guild.id}. Missing permissions.")
-            except Exception as e:
-                log.error(f"An error occurred creating a temp VC: {e}")
+                log.warning(f"Could not send guide to new temp VC {new_channel.id}. Missing Send Messages permission.")
+
+        except discord.Forbidden:
+            log.error(f"Failed to create/move member to temp VC in guild {member.guild.id}. Missing permissions.")
+        except Exception as e:
+            log.error(f"An error occurred creating a temp VC: {e}")
+
+    async def cog_check(self, interaction: discord.Interaction) -> bool:
+        """Checks if the Temp VC system is enabled for this guild."""
+        is_enabled = await database.get_setting(interaction.guild.id, 'temp_vc_system_enabled')
+        if not is_enabled:
+            await interaction.response.send_message("The temporary voice channel system is disabled on this server.", ephemeral=True)
+            return False
+        return True
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # Mute, deafen and stream toggles don't change channels; ignore them before any I/O.
+        if member.bot or before.channel == after.channel:
+            return
+
+        # --- CHANNEL CREATION LOGIC ---
+        if after.channel:
+            enabled, hub_channel_id, _ = await self.get_hub_settings(member.guild.id)
+            if enabled and after.channel.id == hub_channel_id:
+                await self.enqueue_creation(member, after.channel)
 
         # --- CHANNEL DELETION & OWNERSHIP TRANSFER LOGIC ---
         if before.channel:
-            owner_id = await database.get_temp_vc_owner(before.channel.id)
+            owner_id = self.temp_vcs.get(before.channel.id)
             # If the channel is not a temp VC, do nothing
-            if not owner_id:
+            if owner_id is None:
                 return
 
             # --- FIXED LOGIC ---
@@ -123,10 +384,10 @@ class TempVCCog(commands.Cog, name="Temp VCs"):
             if member.id == owner_id and len(before.channel.members) > 0:
                 # 1. Remove the old owner's permissions
                 await before.channel.set_permissions(member, overwrite=None)
-                # 2. Update the database to show the channel is now ownerless (owner_id = 0)
-                await database.update_temp_vc_owner(before.channel.id, 0)
+                # 2. Mark the channel as ownerless (owner_id = 0)
+                await self.set_owner(before.channel.id, 0)
                 # 3. Post the claim button
-                view = ClaimOwnershipView(before.channel)
+                view = ClaimOwnershipView(self, before.channel)
                 message = await before.channel.send("The channel owner has left. Click the button to claim ownership.", view=view)
                 view.message = message
                 log.info(f"Owner {member.id} left VC {before.channel.id}. Channel is now ownerless.")
@@ -136,11 +397,11 @@ class TempVCCog(commands.Cog, name="Temp VCs"):
             if len(before.channel.members) == 0:
                 try:
                     await before.channel.delete(reason="Temporary channel empty.")
-                    await database.remove_temp_vc(before.channel.id)
+                    await self.forget_channel(before.channel.id)
                     log.info(f"Deleted empty temporary VC {before.channel.id}.")
-                except discord.NotFound:
-                    # If the channel is already gone, just clean up the database
-                    await database.remove_temp_vc(before.channel.id)
+                except (discord.NotFound, discord.Forbidden):
+                    # If the channel is already gone (or we can't delete it), just clean up the registry
+                    await self.forget_channel(before.channel.id)
                 except Exception as e:
                     log.error(f"An error occurred deleting a temp VC: {e}")
 
@@ -153,9 +414,9 @@ class TempVCCog(commands.Cog, name="Temp VCs"):
             return None
         
         channel = interaction.user.voice.channel
-        owner_id = await database.get_temp_vc_owner(channel.id)
+        owner_id = self.temp_vcs.get(channel.id)
         
-        if not owner_id:
+        if owner_id is None:
             await interaction.response.send_message("❌ This is not a temporary voice channel.", ephemeral=True)
             return None
         
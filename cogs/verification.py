@@ -2,52 +2,241 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 import random
+import re
 import string
 import logging
 import secrets
 from urllib.parse import urlencode
 import os
+import asyncio
+import time
+from collections import defaultdict
+import io
+from concurrent.futures import ProcessPoolExecutor
 import aiosmtplib
+from email.message import EmailMessage
 
+import captcha
 import database
 import config
+import metrics
 import utils
 
 log = logging.getLogger(__name__)
 
 APP_BASE_URL = os.getenv("APP_BASE_URL", "http://127.0.0.1:5000")
 
-# --- Helper function for sending emails ---
-async def send_verification_email(recipient_email: str, code: str):
+# --- Background email delivery ---
+SMTP_HOSTNAME = "smtp.gmail.com"
+SMTP_PORT = 465
+EMAIL_WORKERS = 2
+EMAIL_MAX_ATTEMPTS = 4
+EMAIL_RETRY_BASE_SECONDS = 5
+SMTP_IDLE_CHECK_SECONDS = 60 # Probe reused sessions with NOOP after this long idle
+GMAIL_CODE_RE = re.compile(r"[0-9]{6}") # ASCII only: str.isdigit() also accepts e.g. Arabic-Indic digits
+
+def get_email_credentials():
     sender = os.getenv("GMAIL_ADDRESS")
     password = os.getenv("GMAIL_APP_PASSWORD")
-    if not sender or not password:
-        log.error("Gmail credentials are not set in .env file.")
-        return False
-    
-    message = f"""Subject: Your Discord Verification Code
+    return (sender, password) if sender and password else None
+
+def build_verification_email(sender: str, recipient_email: str, code: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = recipient_email
+    message["Subject"] = "Your Discord Verification Code"
+    message.set_content(
+        f"Hello,\n\nYour verification code is: {code}\n\n"
+        f"This code will expire in {config.BOT_CONFIG['GMAIL_CODE_TTL_MINUTES']} minutes. Please send it to the bot in a direct message on Discord to complete your verification.\n"
+    )
+    return message
+
+class EmailDeliveryQueue:
+    """A small pool of SMTP workers. Each worker keeps one authenticated session open
+    and reuses it across messages; failed sends are re-queued with exponential backoff."""
+    def __init__(self, worker_count: int = EMAIL_WORKERS, max_attempts: int = EMAIL_MAX_ATTEMPTS,
+                 hostname: str = SMTP_HOSTNAME, port: int = SMTP_PORT, use_tls: bool = True):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.hostname = hostname
+        self.port = port
+        self.use_tls = use_tls
+        self.worker_count = worker_count
+        self.max_attempts = max_attempts
+        self.workers: list[asyncio.Task] = []
+        self.bot = None
+
+    def start(self, bot: commands.Bot):
+        self.bot = bot
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def enqueue(self, user_id: int, recipient_email: str, code: str):
+        self.queue.put_nowait({"user_id": user_id, "recipient": recipient_email, "code": code, "attempt": 1})
+        metrics.set_gauge("email.queue_depth", self.queue.qsize())
+
+    async def _connect(self, sender: str, password: str) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, use_tls=self.use_tls)
+        await smtp.connect()
+        await smtp.login(sender, password)
+        return smtp
+
+    async def _worker(self, worker_id: int):
+        smtp, last_used = None, 0.0
+        try:
+            while True:
+                job = await self.queue.get()
+                metrics.set_gauge("email.queue_depth", self.queue.qsize())
+                credentials = get_email_credentials()
+                if not credentials:
+                    log.error("Gmail credentials are not set in .env file.")
+                    continue
+                sender, password = credentials
+                try:
+                    if smtp and time.monotonic() - last_used > SMTP_IDLE_CHECK_SECONDS:
+                        try:
+                            await smtp.noop()
+                        except aiosmtplib.SMTPException:
+                            smtp.close(); smtp = None
+                    if not smtp or not smtp.is_connected:
+                        smtp = await self._connect(sender, password)
+                    message = build_verification_email(sender, job["recipient"], job["code"])
+                    with metrics.timer("email.send"):
+                        try:
+                            await smtp.send_message(message)
+                        except aiosmtplib.SMTPServerDisconnected:
+                            # The server dropped our idle session; reconnect once before backing off.
+                            smtp.close()
+                            smtp = await self._connect(sender, password)
+                            metrics.incr("email.reconnected")
+                            await smtp.send_message(message)
+                    last_used = time.monotonic()
+                    metrics.incr("email.sent")
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    log.warning(f"Email worker {worker_id} failed to send verification email (attempt {job['attempt']}): {e}")
+                    if smtp:
+                        smtp.close(); smtp = None
+                    await self._retry_or_give_up(job)
+        finally:
+            if smtp:
+                smtp.close()
+
+    async def _retry_or_give_up(self, job: dict):
+        if job["attempt"] < self.max_attempts:
+            delay = EMAIL_RETRY_BASE_SECONDS * 2 ** (job["attempt"] - 1)
+            job["attempt"] += 1
+            metrics.incr("email.retried")
+            asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, job)
+            return
+
+        metrics.incr("email.failed")
+        log.error(f"Giving up on verification email for user {job['user_id']} after {self.max_attempts} attempts.")
+        user = self.bot.get_user(job["user_id"]) if self.bot else None
+        if user:
+            try:
+                await user.send("❌ We couldn't deliver your verification email. Please try again later or contact an admin.")
+            except discord.HTTPException:
+                pass
+
+email_queue = EmailDeliveryQueue()
 
-    Hello,
+# --- Pre-rendered image captchas ---
+CAPTCHA_WORKERS = 2
+CAPTCHA_POOL_SIZE = 200 # Challenges kept ready so a join wave never waits on rendering
 
-    Your verification code is: {code}
+class CaptchaPool:
+    """Keeps a queue of (answer, png) challenges topped up from a process pool, so
+    rendering never runs on the gateway loop and the button can answer instantly."""
+    def __init__(self, size: int = CAPTCHA_POOL_SIZE, worker_count: int = CAPTCHA_WORKERS):
+        self.ready: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.worker_count = worker_count
+        self.executor = None
+        self.refill_task = None
 
-    This code will expire in 10 minutes. Please enter it in the modal on Discord to complete your verification.
-    """
+    def start(self):
+        if not captcha.is_available():
+            log.warning("Pillow is not installed; captcha verification will use plain text challenges.")
+            return
+        if self.executor: return
+        self.executor = ProcessPoolExecutor(max_workers=self.worker_count, initializer=captcha.init_worker)
+        self.refill_task = asyncio.create_task(self._refill())
+
+    def stop(self):
+        if self.refill_task:
+            self.refill_task.cancel()
+            self.refill_task = None
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def _render(self) -> tuple[str, bytes]:
+        loop = asyncio.get_running_loop()
+        with metrics.timer("captcha.render"):
+            return await loop.run_in_executor(self.executor, captcha.generate_challenge)
+
+    async def _refill(self):
+        """Renders `worker_count` challenges at a time until the pool is full, then
+        waits on the queue so taking a challenge wakes it up again."""
+        while True:
+            try:
+                batch = await asyncio.gather(*(self._render() for _ in range(self.worker_count)))
+                for challenge in batch:
+                    await self.ready.put(challenge)
+                metrics.set_gauge("captcha.pool_size", self.ready.qsize())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Failed to pre-render captchas: {e}")
+                await asyncio.sleep(30)
+
+    async def take(self) -> tuple[str, bytes] | None:
+        """Returns a ready challenge, rendering one on demand if the pool has run dry.
+        Returns None when image captchas are unavailable."""
+        if not self.executor: return None
+        try:
+            challenge = self.ready.get_nowait()
+            metrics.incr("captcha.pool_hits")
+        except asyncio.QueueEmpty:
+            metrics.incr("captcha.pool_misses")
+            challenge = await self._render()
+        metrics.set_gauge("captcha.pool_size", self.ready.qsize())
+        return challenge
+
+captcha_pool = CaptchaPool()
+
+# --- Role grants shared by every verification flow ---
+GRANT_BATCH_SIZE = 50
+
+async def get_verification_roles(guild: discord.Guild):
+    """Returns (member_role, unverified_role); either may be None if not configured."""
+    member_role_id = await database.get_setting(guild.id, 'member_role_id')
+    unverified_role_id = await database.get_setting(guild.id, 'unverified_role_id')
+    return guild.get_role(member_role_id), guild.get_role(unverified_role_id)
+
+def _swapped_roles(member: discord.Member, member_role: discord.Role, unverified_role: discord.Role) -> list:
+    roles = [role for role in member.roles if not role.is_default() and role != unverified_role]
+    if member_role not in roles:
+        roles.append(member_role)
+    return roles
+
+async def swap_verification_roles(member: discord.Member, member_role: discord.Role, unverified_role: discord.Role, reason: str):
+    """Adds the member role and drops the unverified role in one member edit, so a
+    failure can never leave someone holding both. The role list comes from the gateway-fed
+    member cache; the member is only fetched when it isn't cached or the edit is rejected
+    (e.g. a cached role was deleted meanwhile)."""
+    guild = member.guild
+    cached = guild.get_member(member.id) or await guild.fetch_member(member.id)
     try:
-        await aiosmtplib.send(
-            message,
-            sender=sender,
-            recipients=[recipient_email],
-            hostname="smtp.gmail.com",
-            port=465,
-            use_tls=True,
-            username=sender,
-            password=password,
-        )
-        return True
-    except Exception as e:
-        log.error(f"Failed to send verification email: {e}")
-        return False
+        await cached.edit(roles=_swapped_roles(cached, member_role, unverified_role), reason=reason)
+    except discord.HTTPException as e:
+        if isinstance(e, discord.Forbidden) or e.status == 429:
+            raise
+        metrics.incr("verification.role_swap_refetched")
+        fresh = await guild.fetch_member(member.id)
+        await fresh.edit(roles=_swapped_roles(fresh, member_role, unverified_role), reason=reason)
 
 # --- Modals for different verification flows ---
 class EmailInputModal(discord.ui.Modal, title="Gmail Verification"):
@@ -57,38 +246,48 @@ class EmailInputModal(discord.ui.Modal, title="Gmail Verification"):
         await interaction.response.defer(ephemeral=True)
         code = str(random.randint(100000, 999999))
         
+        if not get_email_credentials():
+            log.error("Gmail credentials are not set in .env file.")
+            return await interaction.followup.send("❌ Failed to send verification email. Please contact an admin.", ephemeral=True)
+
         await database.store_gmail_code(interaction.guild.id, interaction.user.id, code)
-        
-        success = await send_verification_email(self.email.value, code)
-        if success:
-            await interaction.followup.send(
-                "✅ An email with your verification code has been sent. Please check your inbox (and spam folder), then **send the 6-digit code to me in a direct message (DM)** to complete verification.",
-                ephemeral=True
-            )
-        else:
-            await interaction.followup.send("❌ Failed to send verification email. Please contact an admin.", ephemeral=True)
+        email_queue.enqueue(interaction.user.id, self.email.value, code)
+        await interaction.followup.send(
+            "✅ Your verification code is on its way. Please check your inbox (and spam folder) in a moment, then **send the 6-digit code to me in a direct message (DM)** to complete verification.",
+            ephemeral=True
+        )
 
 class CaptchaModal(discord.ui.Modal, title="Server Verification"):
-    def __init__(self, captcha_text: str):
+    def __init__(self, captcha_text: str, from_image: bool = False):
         super().__init__()
         self.captcha_text = captcha_text
-        self.add_item(discord.ui.TextInput(label=f"Please type the following text:", placeholder=self.captcha_text, style=discord.TextStyle.short, required=True, max_length=len(captcha_text)))
+        if from_image:
+            text_input = discord.ui.TextInput(label="Type the characters shown in the image:", style=discord.TextStyle.short, required=True, max_length=len(captcha_text))
+        else:
+            text_input = discord.ui.TextInput(label=f"Please type the following text:", placeholder=self.captcha_text, style=discord.TextStyle.short, required=True, max_length=len(captcha_text))
+        self.add_item(text_input)
         
     async def on_submit(self, interaction: discord.Interaction):
-        member_role_id = await database.get_setting(interaction.guild.id, 'member_role_id')
-        unverified_role_id = await database.get_setting(interaction.guild.id, 'unverified_role_id')
-        member_role = interaction.guild.get_role(member_role_id)
-        unverified_role = interaction.guild.get_role(unverified_role_id)
+        member_role, unverified_role = await get_verification_roles(interaction.guild)
         if not member_role or not unverified_role:
             return await interaction.response.send_message("❌ Verification roles not configured correctly.", ephemeral=True)
 
-        if self.children[0].value.lower() == self.captcha_text.lower():
-            await interaction.user.add_roles(member_role, reason="Captcha success.")
-            await interaction.user.remove_roles(unverified_role, reason="Captcha success.")
+        if self.children[0].value.strip().lower() == self.captcha_text.lower():
+            await swap_verification_roles(interaction.user, member_role, unverified_role, reason="Captcha success.")
             await interaction.response.send_message("✅ Verification successful!", ephemeral=True)
         else:
             await interaction.response.send_message("❌ Incorrect captcha. Please try again.", ephemeral=True)
 
+class CaptchaAnswerView(discord.ui.View):
+    """Sent alongside the captcha image; opens the answer modal."""
+    def __init__(self, captcha_text: str):
+        super().__init__(timeout=300)
+        self.captcha_text = captcha_text
+
+    @discord.ui.button(label="Enter Code", style=discord.ButtonStyle.primary, emoji="⌨️")
+    async def enter_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(CaptchaModal(self.captcha_text, from_image=True))
+
 class VerificationButton(discord.ui.View):
     def __init__(self, bot: commands.Bot):
         super().__init__(timeout=None)
@@ -103,8 +302,18 @@ class VerificationButton(discord.ui.View):
         mode = await database.get_setting(interaction.guild.id, 'verification_mode') or 'captcha'
 
         if mode == 'captcha':
-            captcha_text = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            await interaction.response.send_modal(CaptchaModal(captcha_text))
+            challenge = await captcha_pool.take()
+            if not challenge:
+                captcha_text = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+                return await interaction.response.send_modal(CaptchaModal(captcha_text))
+            captcha_text, image = challenge
+            embed = discord.Embed(
+                title="Server Verification",
+                description="Type the characters shown below. Click **Enter Code** when you're ready.",
+                color=config.BOT_CONFIG["EMBED_COLORS"]["INFO"]
+            )
+            embed.set_image(url="attachment://captcha.png")
+            await interaction.response.send_message(embed=embed, file=discord.File(io.BytesIO(image), filename="captcha.png"), view=CaptchaAnswerView(captcha_text), ephemeral=True)
         
         elif mode == 'twitch' or mode == 'youtube':
             state = secrets.token_urlsafe(16)
@@ -145,38 +354,96 @@ class VerificationButton(discord.ui.View):
         else:
             await interaction.response.send_message("❌ Unknown verification mode.", ephemeral=True)
 
+# --- Rate limiting for DM code guesses ---
+CODE_ATTEMPT_BURST = 5 # Wrong guesses allowed back-to-back
+CODE_ATTEMPT_REFILL_SECONDS = 60 # One more guess is allowed per this many seconds
+
+class TokenBucket:
+    """In-memory token bucket per key. Keys that refill completely are dropped so
+    the dict only holds users who have guessed wrong recently."""
+    def __init__(self, capacity: int, refill_seconds: float):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.buckets: dict[int, tuple[float, float]] = {}
+
+    def _current(self, key: int) -> float:
+        if key not in self.buckets: return self.capacity
+        tokens, updated_at = self.buckets[key]
+        tokens = min(self.capacity, tokens + (time.monotonic() - updated_at) / self.refill_seconds)
+        if tokens >= self.capacity:
+            del self.buckets[key]
+        return tokens
+
+    def has_tokens(self, key: int) -> bool:
+        return self._current(key) >= 1
+
+    def consume(self, key: int):
+        self.buckets[key] = (max(0.0, self._current(key) - 1), time.monotonic())
+
 # --- The Main Cog for Verification ---
 class VerificationCog(commands.Cog, name="Verification"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.completion_consumer = None
+        self.code_attempts = TokenBucket(CODE_ATTEMPT_BURST, CODE_ATTEMPT_REFILL_SECONDS)
         self.check_verifications.start()
 
+    async def cog_load(self):
+        self.completion_consumer = asyncio.create_task(self.process_verification_grants())
+        email_queue.start(self.bot)
+        captcha_pool.start()
+
     def cog_unload(self):
         self.check_verifications.cancel()
+        email_queue.stop()
+        captcha_pool.stop()
+        if self.completion_consumer:
+            self.completion_consumer.cancel()
 
-    @tasks.loop(seconds=15)
-    async def check_verifications(self):
-        completed_users = await database.get_completed_verifications()
-        for state, guild_id, user_id in completed_users:
-            guild = self.bot.get_guild(guild_id)
-            if not guild: continue
-            
+    async def _grant_guild_batch(self, guild_id: int, grants: dict[str, int]):
+        """Applies every queued OAuth grant for one guild, one member edit each."""
+        guild = self.bot.get_guild(guild_id)
+        if not guild: return
+        member_role, unverified_role = await get_verification_roles(guild)
+        if not member_role or not unverified_role: return
+
+        granted_states = []
+        for state, user_id in grants.items():
             member = guild.get_member(user_id)
-            if not member: continue
-            
-            member_role_id = await database.get_setting(guild.id, 'member_role_id')
-            unverified_role_id = await database.get_setting(guild.id, 'unverified_role_id')
+            if not member: continue # Left for the reconciliation sweep
+            try:
+                await utils.call_with_rate_limit_retry(lambda: swap_verification_roles(member, member_role, unverified_role, reason="OAuth Verification Success"))
+                granted_states.append(state)
+            except (discord.HTTPException, discord.RateLimited) as e:
+                log.error(f"Error granting roles via verification: {e}")
+        if granted_states:
+            await database.delete_verification_links(granted_states)
+            metrics.incr("verification.grants.applied", len(granted_states))
 
-            if member_role_id and unverified_role_id:
-                try:
-                    member_role = guild.get_role(member_role_id)
-                    unverified_role = guild.get_role(unverified_role_id)
-                    if member_role and unverified_role:
-                        await member.add_roles(member_role, reason="OAuth Verification Success")
-                        await member.remove_roles(unverified_role, reason="OAuth Verification Success")
-                        await database.delete_verification_link(state)
-                except Exception as e:
-                    log.error(f"Error granting roles via verification: {e}")
+    async def process_verification_grants(self):
+        """Drains the completion queue in batches and applies the grants per guild,
+        guilds in parallel, so a large backlog clears at Discord's per-guild pace."""
+        await self.bot.wait_until_ready()
+        queue = database.verification_completions
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < GRANT_BATCH_SIZE:
+                batch.append(queue.get_nowait())
+            metrics.set_gauge("verification.grants.queue_depth", queue.qsize())
+
+            by_guild = defaultdict(dict)
+            for state, guild_id, user_id in batch:
+                by_guild[guild_id][state] = user_id # Same state queued twice collapses here
+            results = await asyncio.gather(*(self._grant_guild_batch(guild_id, grants) for guild_id, grants in by_guild.items()), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    log.error(f"Failed to process verification grants: {result}")
+
+    @tasks.loop(minutes=5)
+    async def check_verifications(self):
+        """Reconciliation sweep for completions the push path missed (e.g. member not cached yet)."""
+        for row in await database.get_completed_verifications():
+            database.verification_completions.put_nowait(tuple(row))
 
     @check_verifications.before_loop
     async def before_check_verifications(self):
@@ -184,21 +451,24 @@ class VerificationCog(commands.Cog, name="Verification"):
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if message.guild is not None or message.author.bot or not message.content.isdigit() or len(message.content) != 6:
+        if message.guild is not None or message.author.bot or not GMAIL_CODE_RE.fullmatch(message.content):
             return
 
         user = message.author
         code = message.content
 
-        for guild in user.mutual_guilds:
-            stored_code = await database.get_gmail_code(guild.id, user.id)
-            if stored_code and stored_code == code:
+        # Users who keep guessing wrong are turned away before we touch the database.
+        if not self.code_attempts.has_tokens(user.id):
+            await message.channel.send("⏳ Too many incorrect codes. Please wait a few minutes before trying again.")
+            return
+
+        mutual_guild_ids = {guild.id for guild in user.mutual_guilds}
+        for guild_id, stored_code in await database.get_pending_gmail_codes(user.id):
+            guild = self.bot.get_guild(guild_id)
+            if guild_id in mutual_guild_ids and guild and secrets.compare_digest(str(stored_code).encode(), code.encode()):
                 log.info(f"Found matching Gmail code for user {user.id} in guild {guild.id}")
                 
-                member_role_id = await database.get_setting(guild.id, 'member_role_id')
-                unverified_role_id = await database.get_setting(guild.id, 'unverified_role_id')
-                member_role = guild.get_role(member_role_id)
-                unverified_role = guild.get_role(unverified_role_id)
+                member_role, unverified_role = await get_verification_roles(guild)
                 member = guild.get_member(user.id)
 
                 if not member_role or not unverified_role or not member:
@@ -206,8 +476,7 @@ class VerificationCog(commands.Cog, name="Verification"):
                     return
 
                 try:
-                    await member.add_roles(member_role, reason="Gmail DM verification success.")
-                    await member.remove_roles(unverified_role, reason="Gmail DM verification success.")
+                    await swap_verification_roles(member, member_role, unverified_role, reason="Gmail DM verification success.")
                     await database.delete_gmail_code(guild.id, user.id)
                     await message.channel.send(f"✅ You have been successfully verified in **{guild.name}**!")
                     return
@@ -215,6 +484,7 @@ class VerificationCog(commands.Cog, name="Verification"):
                     await message.channel.send(f"❌ Verification failed in **{guild.name}**. I don't have permission to manage your roles there.")
                     return
         
+        self.code_attempts.consume(user.id)
         await message.channel.send("❌ That code is incorrect or has expired. Please start the verification process again in your server.")
 
     @app_commands.command(name="setup_verification", description="Sends the verification message.")
@@ -13,6 +13,23 @@ BOT_CONFIG = {
 
     "DEFAULT_MUTE_MINS": 30,
 
+    # Rendered /leaderboard and /koth pages are reused until the leaderboard changes
+    # or this many seconds pass (so renamed users and new avatars still show up).
+    "LEADERBOARD_CACHE_SECONDS": 300,
+    # Also keep gzip (and brotli, if installed) copies of each cached page.
+    "LEADERBOARD_PRECOMPRESS": True,
+
+    # Unfinished OAuth links and Gmail codes are swept once they pass these ages.
+    "VERIFICATION_LINK_TTL_MINUTES": 60,
+    "GMAIL_CODE_TTL_MINUTES": 10,
+    # Verified links waiting for their role grant (e.g. member not cached yet) are
+    # kept this long, so the reconciliation sweep can still apply them.
+    "VERIFIED_LINK_TTL_HOURS": 168,
+
+    # Hourly incrementals are kept for `hourly_hours`, every daily base for
+    # `daily_days`, and one base per week after that for `weekly_weeks`.
+    "BACKUP_RETENTION": {"hourly_hours": 48, "daily_days": 14, "weekly_weeks": 8},
+
     "MILESTONE_EXCLUDED_IDS": [
         902664751778267147, # Dimitri's ID
         927313212704178237, # Soren's ID
@@ -1,13 +1,103 @@
 import aiosqlite
+import asyncio
+import inspect
+import json
 import logging
 from datetime import datetime
 import secrets
 from typing import Optional
+from collections import defaultdict
+
+import config
 
 log = logging.getLogger(__name__)
 DB_FILE = "bot_database.db"
 db_conn = None
 
+# --- LEADERBOARD VERSION COUNTERS ---
+# Bumped on every write to a guild's XP or KOTH leaderboard, so readers such as
+# the web server's page cache can tell when what they rendered has gone stale.
+leaderboard_versions = defaultdict(int)
+restore_generation = 0 # Bumped by notify_database_restored; every leaderboard may have changed
+
+def bump_leaderboard_version(guild_id, board):
+    leaderboard_versions[(guild_id, board)] += 1
+
+def get_leaderboard_version(guild_id, board):
+    # Both counters only grow, so their sum changes whenever either does.
+    return leaderboard_versions[(guild_id, board)] + restore_generation
+
+# --- CHANGE TRACKING ---
+# Tables covered by incremental backups, with their primary key columns. Triggers
+# log the key of every touched row to change_log; the backup job later reads the
+# current version of each logged row (or notes that it was deleted).
+CHANGE_TRACKED_TABLES = {
+    "guild_settings": ("guild_id",),
+    "warnings": ("warning_id",),
+    "reaction_roles": ("message_id", "emoji"),
+    "music_submissions": ("submission_id",),
+    "koth_leaderboard": ("user_id", "guild_id"),
+    "ranking": ("user_id", "guild_id"),
+    "bad_words": ("word_id",),
+    "rank_rewards": ("guild_id", "rank_level"),
+    "user_custom_roles": ("guild_id", "user_id"),
+    "widget_tokens": ("token",),
+    "guild_permission_roles": ("guild_id", "role_id", "level"),
+}
+
+# --- PERMISSION ROLE LEVELS ---
+PERMISSION_LEVEL_ADMIN = "admin"
+PERMISSION_LEVEL_MOD = "mod"
+
+# --- CHANGE EVENTS ---
+# In-process pub/sub so caches elsewhere can refresh when the data behind them
+# changes. Callbacks receive the event's fields as keyword arguments; coroutine
+# callbacks are run as tasks so emitting never blocks the writer.
+EVENT_SETTING_CHANGED = "setting_changed" # guild_id, setting_name, value
+EVENT_BAD_WORDS_CHANGED = "bad_words_changed" # guild_id
+EVENT_RANK_REWARD_CHANGED = "rank_reward_changed" # guild_id, rank_level, role_id (None when removed)
+EVENT_PERMISSION_ROLES_CHANGED = "permission_roles_changed" # guild_id
+EVENT_DATABASE_RESTORED = "database_restored" # no fields; any cached row may have changed
+
+_subscribers = defaultdict(list)
+_callback_tasks = set()
+
+def subscribe(event: str, callback):
+    _subscribers[event].append(callback)
+
+def unsubscribe(event: str, callback):
+    if callback in _subscribers[event]:
+        _subscribers[event].remove(callback)
+
+def _log_callback_error(task: asyncio.Task):
+    _callback_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        log.error(f"Change event callback failed: {task.exception()}", exc_info=task.exception())
+
+def emit(event: str, **fields):
+    for callback in list(_subscribers[event]):
+        try:
+            result = callback(**fields)
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                _callback_tasks.add(task)
+                task.add_done_callback(_log_callback_error)
+        except Exception as e:
+            log.error(f"Change event callback for {event} failed: {e}", exc_info=True)
+
+def notify_database_restored():
+    """Called after the database file is replaced by a restore: stales every leaderboard
+    and tells caches to drop what they hold."""
+    global restore_generation
+    restore_generation += 1
+    emit(EVENT_DATABASE_RESTORED)
+
+# --- VERIFICATION COMPLETION EVENTS ---
+# The web server shares the bot's event loop, so OAuth callbacks push each
+# finished verification as (state, guild_id, user_id) and the Verification cog
+# grants roles straight away instead of waiting for its next poll.
+verification_completions: asyncio.Queue = asyncio.Queue()
+
 async def get_db_connection():
     """Gets a connection to the SQLite database."""
     global db_conn
@@ -43,7 +133,10 @@ async def initialize_database():
         """)
         await cursor.execute("CREATE TABLE IF NOT EXISTS warnings (warning_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, moderator_id INTEGER NOT NULL, reason TEXT, issued_at TIMESTAMP NOT NULL, log_message_id INTEGER)")
         await cursor.execute("CREATE TABLE IF NOT EXISTS reaction_roles (message_id INTEGER NOT NULL, emoji TEXT NOT NULL, role_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, PRIMARY KEY (message_id, emoji))")
+        await cursor.execute("CREATE TABLE IF NOT EXISTS reaction_role_sync (message_id INTEGER NOT NULL, emoji TEXT NOT NULL, last_user_id INTEGER NOT NULL, PRIMARY KEY (message_id, emoji))")
+        await cursor.execute("CREATE TABLE IF NOT EXISTS reaction_role_members (message_id INTEGER NOT NULL, emoji TEXT NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (message_id, emoji, user_id)) WITHOUT ROWID")
         await cursor.execute("CREATE TABLE IF NOT EXISTS temporary_vcs (channel_id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL, text_channel_id INTEGER)")
+        await cursor.execute("CREATE TABLE IF NOT EXISTS temp_vc_pool (channel_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL)")
         await cursor.execute("CREATE TABLE IF NOT EXISTS music_submissions ( submission_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, track_url TEXT NOT NULL, status TEXT NOT NULL, submitted_at TIMESTAMP NOT NULL, reviewer_id INTEGER, submission_type TEXT DEFAULT 'regular' )")
         await cursor.execute("CREATE TABLE IF NOT EXISTS koth_leaderboard ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, points INTEGER DEFAULT 0, PRIMARY KEY (user_id, guild_id) )")
         await cursor.execute("CREATE TABLE IF NOT EXISTS ranking ( user_id INTEGER NOT NULL, guild_id INTEGER NOT NULL, xp INTEGER DEFAULT 0, PRIMARY KEY (user_id, guild_id) )")
@@ -53,6 +146,8 @@ async def initialize_database():
         await cursor.execute("CREATE TABLE IF NOT EXISTS rank_rewards (guild_id INTEGER NOT NULL, rank_level INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (guild_id, rank_level))")
         await cursor.execute("CREATE TABLE IF NOT EXISTS user_custom_roles (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (guild_id, user_id))")
         await cursor.execute("CREATE TABLE IF NOT EXISTS widget_tokens (token TEXT PRIMARY KEY, guild_id INTEGER NOT NULL UNIQUE)")
+        # Clustered on the primary key, so loading a guild's roles is one range scan.
+        await cursor.execute("CREATE TABLE IF NOT EXISTS guild_permission_roles (guild_id INTEGER NOT NULL, role_id INTEGER NOT NULL, level TEXT NOT NULL, PRIMARY KEY (guild_id, role_id, level)) WITHOUT ROWID")
 
         # --- Schema Updates ---
         await cursor.execute("PRAGMA table_info(guild_settings)")
@@ -73,6 +168,7 @@ async def initialize_database():
             await cursor.execute("ALTER TABLE guild_settings ADD COLUMN reporting_system_enabled INTEGER DEFAULT 1")
         if 'ranking_system_enabled' not in settings_columns: 
             await cursor.execute("ALTER TABLE guild_settings ADD COLUMN ranking_system_enabled INTEGER DEFAULT 1")
+        if 'temp_vc_pool_size' not in settings_columns: await cursor.execute("ALTER TABLE guild_settings ADD COLUMN temp_vc_pool_size INTEGER DEFAULT 0")
 
         await cursor.execute("PRAGMA table_info(koth_leaderboard)")
         koth_columns = [row[1] for row in await cursor.fetchall()]
@@ -86,6 +182,58 @@ async def initialize_database():
         if 'reason' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN reason TEXT")
         if 'issued_at' not in warnings_columns: await cursor.execute("ALTER TABLE warnings ADD COLUMN issued_at TIMESTAMP")
 
+        await cursor.execute("PRAGMA table_info(reaction_roles)")
+        reaction_role_columns = [row[1] for row in await cursor.fetchall()]
+        if 'channel_id' not in reaction_role_columns: await cursor.execute("ALTER TABLE reaction_roles ADD COLUMN channel_id INTEGER")
+
+        await cursor.execute("PRAGMA table_info(verification_links)")
+        link_columns = [row[1] for row in await cursor.fetchall()]
+        if 'created_at' not in link_columns: await cursor.execute("ALTER TABLE verification_links ADD COLUMN created_at TIMESTAMP")
+        if 'expires_at' not in link_columns: await cursor.execute("ALTER TABLE verification_links ADD COLUMN expires_at TIMESTAMP")
+        await cursor.execute("UPDATE verification_links SET created_at = COALESCE(created_at, datetime('now')), expires_at = datetime('now', ?) WHERE expires_at IS NULL", (f"+{config.BOT_CONFIG['VERIFICATION_LINK_TTL_MINUTES']} minutes",))
+
+        # Move the old comma-separated admin/mod role columns into guild_permission_roles, then clear them
+        # so removed roles can't be migrated back on the next start.
+        await cursor.execute("SELECT guild_id, admin_role_ids, mod_role_ids FROM guild_settings WHERE COALESCE(admin_role_ids, '') != '' OR COALESCE(mod_role_ids, '') != ''")
+        for guild_id, admin_roles_str, mod_roles_str in await cursor.fetchall():
+            for level, roles_str in ((PERMISSION_LEVEL_ADMIN, admin_roles_str), (PERMISSION_LEVEL_MOD, mod_roles_str)):
+                role_ids = [int(role_id) for role_id in (roles_str or "").split(',') if role_id]
+                await cursor.executemany("INSERT OR IGNORE INTO guild_permission_roles (guild_id, role_id, level) VALUES (?, ?, ?)", [(guild_id, role_id, level) for role_id in role_ids])
+            await cursor.execute("UPDATE guild_settings SET admin_role_ids = NULL, mod_role_ids = NULL WHERE guild_id = ?", (guild_id,))
+
+        await cursor.execute("PRAGMA table_info(gmail_verification)")
+        gmail_columns = [row[1] for row in await cursor.fetchall()]
+        if 'expires_at' not in gmail_columns: await cursor.execute("ALTER TABLE gmail_verification ADD COLUMN expires_at TIMESTAMP")
+        await cursor.execute("UPDATE gmail_verification SET expires_at = datetime(created_at, ?) WHERE expires_at IS NULL", (f"+{config.BOT_CONFIG['GMAIL_CODE_TTL_MINUTES']} minutes",))
+
+        # --- Change Tracking ---
+        await cursor.execute("CREATE TABLE IF NOT EXISTS change_log (change_id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, row_key TEXT NOT NULL)")
+        for table, key_columns in CHANGE_TRACKED_TABLES.items():
+            new_key = ", ".join(f"NEW.{column}" for column in key_columns)
+            old_key = ", ".join(f"OLD.{column}" for column in key_columns)
+            key_changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in key_columns)
+            await cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON {table} BEGIN INSERT INTO change_log (table_name, row_key) VALUES ('{table}', json_array({new_key})); END")
+            await cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_update AFTER UPDATE ON {table} BEGIN INSERT INTO change_log (table_name, row_key) VALUES ('{table}', json_array({new_key})); END")
+            await cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_rekey AFTER UPDATE ON {table} WHEN {key_changed} BEGIN INSERT INTO change_log (table_name, row_key) VALUES ('{table}', json_array({old_key})); END")
+            await cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON {table} BEGIN INSERT INTO change_log (table_name, row_key) VALUES ('{table}', json_array({old_key})); END")
+
+        # --- Scheduler ---
+        await cursor.execute("CREATE TABLE IF NOT EXISTS scheduled_jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, job_key TEXT UNIQUE, name TEXT NOT NULL, run_at REAL NOT NULL, base_run_at REAL, interval_seconds REAL, jitter_seconds REAL DEFAULT 0, catch_up TEXT DEFAULT 'run_once', payload TEXT)")
+
+        await cursor.execute("PRAGMA table_info(scheduled_jobs)")
+        scheduled_job_columns = [row[1] for row in await cursor.fetchall()]
+        if 'base_run_at' not in scheduled_job_columns: await cursor.execute("ALTER TABLE scheduled_jobs ADD COLUMN base_run_at REAL")
+
+        # --- Indexes ---
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_run_at ON scheduled_jobs (run_at)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_ranking_guild_xp ON ranking (guild_id, xp DESC, user_id)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_koth_guild_points ON koth_leaderboard (guild_id, points DESC, user_id)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_queue ON music_submissions (guild_id, submission_type, status, submitted_at)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_verification_links_status ON verification_links (status)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_verification_links_expires ON verification_links (expires_at)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_gmail_verification_expires ON gmail_verification (expires_at)")
+        await cursor.execute("CREATE INDEX IF NOT EXISTS idx_gmail_verification_user ON gmail_verification (user_id, expires_at)")
+
     await conn.commit()
     log.info("Database tables initialized/updated successfully.")
 
@@ -103,6 +251,7 @@ async def update_setting(guild_id, setting_name, value):
     sql = f"INSERT INTO guild_settings (guild_id, {setting_name}) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET {setting_name} = excluded.{setting_name}"
     await conn.execute(sql, (guild_id, value))
     await conn.commit()
+    emit(EVENT_SETTING_CHANGED, guild_id=guild_id, setting_name=setting_name, value=value)
 
 async def get_all_settings(guild_id):
     conn = await get_db_connection()
@@ -113,16 +262,52 @@ async def get_all_settings(guild_id):
         columns = [description[0] for description in cursor.description]
         return dict(zip(columns, row))
 
+# --- PERMISSION ROLE FUNCTIONS ---
+async def add_permission_role(guild_id: int, role_id: int, level: str) -> bool:
+    """Returns False if the role already had that level."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("INSERT OR IGNORE INTO guild_permission_roles (guild_id, role_id, level) VALUES (?, ?, ?)", (guild_id, role_id, level))
+        added = cursor.rowcount > 0
+    await conn.commit()
+    if added:
+        emit(EVENT_PERMISSION_ROLES_CHANGED, guild_id=guild_id)
+    return added
+
+async def remove_permission_role(guild_id: int, role_id: int, level: str) -> bool:
+    """Returns False if the role didn't have that level."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("DELETE FROM guild_permission_roles WHERE guild_id = ? AND role_id = ? AND level = ?", (guild_id, role_id, level))
+        removed = cursor.rowcount > 0
+    await conn.commit()
+    if removed:
+        emit(EVENT_PERMISSION_ROLES_CHANGED, guild_id=guild_id)
+    return removed
+
+async def get_permission_roles(guild_id: int) -> dict[str, list[int]]:
+    """Returns {level: [role_id, ...]} for every permission level configured in the guild."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT role_id, level FROM guild_permission_roles WHERE guild_id = ?", (guild_id,))
+        rows = await cursor.fetchall()
+    roles = defaultdict(list)
+    for role_id, level in rows:
+        roles[level].append(role_id)
+    return dict(roles)
+
 # --- RANK REWARD FUNCTIONS ---
 async def set_rank_reward(guild_id: int, rank_level: int, role_id: int):
     conn = await get_db_connection()
     await conn.execute("INSERT INTO rank_rewards (guild_id, rank_level, role_id) VALUES (?, ?, ?) ON CONFLICT(guild_id, rank_level) DO UPDATE SET role_id = excluded.role_id", (guild_id, rank_level, role_id))
     await conn.commit()
+    emit(EVENT_RANK_REWARD_CHANGED, guild_id=guild_id, rank_level=rank_level, role_id=role_id)
 
 async def remove_rank_reward(guild_id: int, rank_level: int):
     conn = await get_db_connection()
     await conn.execute("DELETE FROM rank_rewards WHERE guild_id = ? AND rank_level = ?", (guild_id, rank_level))
     await conn.commit()
+    emit(EVENT_RANK_REWARD_CHANGED, guild_id=guild_id, rank_level=rank_level, role_id=None)
 
 async def get_rank_reward(guild_id: int, rank_level: int):
     conn = await get_db_connection()
@@ -168,9 +353,9 @@ async def clear_warnings(guild_id, user_id):
     await conn.commit()
 
 # --- REACTION ROLES FUNCTIONS ---
-async def add_reaction_role(guild_id, message_id, emoji, role_id):
+async def add_reaction_role(guild_id, message_id, emoji, role_id, channel_id=None):
     conn = await get_db_connection()
-    await conn.execute("INSERT OR REPLACE INTO reaction_roles (guild_id, message_id, emoji, role_id) VALUES (?, ?, ?, ?)", (guild_id, message_id, emoji, role_id))
+    await conn.execute("INSERT OR REPLACE INTO reaction_roles (guild_id, message_id, emoji, role_id, channel_id) VALUES (?, ?, ?, ?, ?)", (guild_id, message_id, emoji, role_id, channel_id))
     await conn.commit()
 
 async def get_reaction_role(message_id, emoji):
@@ -180,6 +365,116 @@ async def get_reaction_role(message_id, emoji):
         result = await cursor.fetchone()
         return result[0] if result else None
 
+async def get_all_reaction_roles():
+    """Returns {message_id: {emoji: role_id}} for every reaction-role mapping."""
+    conn = await get_db_connection()
+    mappings = defaultdict(dict)
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT message_id, emoji, role_id FROM reaction_roles")
+        for message_id, emoji, role_id in await cursor.fetchall():
+            mappings[message_id][emoji] = role_id
+    return dict(mappings)
+
+async def delete_reaction_roles_for_messages(message_ids):
+    if not message_ids: return
+    conn = await get_db_connection()
+    placeholders = ",".join("?" * len(message_ids))
+    await conn.execute(f"DELETE FROM reaction_roles WHERE message_id IN ({placeholders})", tuple(message_ids))
+    await conn.execute(f"DELETE FROM reaction_role_sync WHERE message_id IN ({placeholders})", tuple(message_ids))
+    await conn.execute(f"DELETE FROM reaction_role_members WHERE message_id IN ({placeholders})", tuple(message_ids))
+    await conn.commit()
+
+async def get_reaction_role_messages():
+    """Returns (guild_id, channel_id, message_id) for each reaction-role message. channel_id
+    is None for mappings created before it was recorded."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT guild_id, MAX(channel_id), message_id FROM reaction_roles GROUP BY guild_id, message_id")
+        return await cursor.fetchall()
+
+async def set_reaction_role_channel(message_id, channel_id):
+    conn = await get_db_connection()
+    await conn.execute("UPDATE reaction_roles SET channel_id = ? WHERE message_id = ?", (channel_id, message_id))
+    await conn.commit()
+
+async def get_reaction_sync_checkpoint(message_id, emoji):
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT last_user_id FROM reaction_role_sync WHERE message_id = ? AND emoji = ?", (message_id, emoji))
+        result = await cursor.fetchone()
+        return result[0] if result else None
+
+async def save_reaction_sync_checkpoint(message_id, emoji, last_user_id):
+    conn = await get_db_connection()
+    await conn.execute("INSERT OR REPLACE INTO reaction_role_sync (message_id, emoji, last_user_id) VALUES (?, ?, ?)", (message_id, emoji, last_user_id))
+    await conn.commit()
+
+async def clear_reaction_sync_checkpoint(message_id, emoji):
+    conn = await get_db_connection()
+    await conn.execute("DELETE FROM reaction_role_sync WHERE message_id = ? AND emoji = ?", (message_id, emoji))
+    await conn.commit()
+
+async def get_reaction_role_members(message_id, emoji):
+    """Returns the IDs of users seen reacting with `emoji`, i.e. those the reaction role was given to."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT user_id FROM reaction_role_members WHERE message_id = ? AND emoji = ?", (message_id, emoji))
+        return {row[0] for row in await cursor.fetchall()}
+
+async def add_reaction_role_members(message_id, emoji, user_ids):
+    if not user_ids: return
+    conn = await get_db_connection()
+    await conn.executemany("INSERT OR IGNORE INTO reaction_role_members (message_id, emoji, user_id) VALUES (?, ?, ?)", [(message_id, emoji, user_id) for user_id in user_ids])
+    await conn.commit()
+
+async def remove_reaction_role_members(message_id, emoji, user_ids):
+    if not user_ids: return
+    conn = await get_db_connection()
+    await conn.executemany("DELETE FROM reaction_role_members WHERE message_id = ? AND emoji = ? AND user_id = ?", [(message_id, emoji, user_id) for user_id in user_ids])
+    await conn.commit()
+
+# --- BACKUP FUNCTIONS ---
+async def trim_change_log(up_to_change_id):
+    """Drops change_log entries that a backup has already captured."""
+    conn = await get_db_connection()
+    await conn.execute("DELETE FROM change_log WHERE change_id <= ?", (up_to_change_id,))
+    await conn.commit()
+
+# --- SCHEDULED JOB FUNCTIONS ---
+async def save_scheduled_job(job_key, name, base_run_at, run_at, interval_seconds, jitter_seconds, catch_up, payload):
+    """Stores a job and returns its id. A job with the same key is replaced.
+    `base_run_at` is the slot on the job's interval grid; `run_at` adds the jitter."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        if job_key is not None:
+            await cursor.execute("DELETE FROM scheduled_jobs WHERE job_key = ?", (job_key,))
+        await cursor.execute("INSERT INTO scheduled_jobs (job_key, name, base_run_at, run_at, interval_seconds, jitter_seconds, catch_up, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (job_key, name, base_run_at, run_at, interval_seconds, jitter_seconds, catch_up, payload))
+        job_id = cursor.lastrowid
+    await conn.commit()
+    return job_id
+
+async def get_scheduled_jobs():
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT job_id, job_key, name, run_at, interval_seconds, jitter_seconds, catch_up, payload, base_run_at FROM scheduled_jobs ORDER BY run_at")
+        rows = await cursor.fetchall()
+    return [
+        {"job_id": row[0], "job_key": row[1], "name": row[2], "run_at": row[3], "interval_seconds": row[4],
+         "jitter_seconds": row[5], "catch_up": row[6], "payload": json.loads(row[7]) if row[7] else {},
+         "base_run_at": row[8] if row[8] is not None else row[3]}
+        for row in rows
+    ]
+
+async def update_scheduled_job_run_at(job_id, base_run_at, run_at):
+    conn = await get_db_connection()
+    await conn.execute("UPDATE scheduled_jobs SET base_run_at = ?, run_at = ? WHERE job_id = ?", (base_run_at, run_at, job_id))
+    await conn.commit()
+
+async def delete_scheduled_job(job_id):
+    conn = await get_db_connection()
+    await conn.execute("DELETE FROM scheduled_jobs WHERE job_id = ?", (job_id,))
+    await conn.commit()
+
 # --- TEMP VC FUNCTIONS ---
 async def add_temp_vc(channel_id, owner_id, text_channel_id=None):
     conn = await get_db_connection()
@@ -191,6 +486,40 @@ async def remove_temp_vc(channel_id):
     await conn.execute("DELETE FROM temporary_vcs WHERE channel_id = ?", (channel_id,))
     await conn.commit()
 
+async def remove_temp_vcs(channel_ids):
+    if not channel_ids: return
+    conn = await get_db_connection()
+    placeholders = ",".join("?" * len(channel_ids))
+    await conn.execute(f"DELETE FROM temporary_vcs WHERE channel_id IN ({placeholders})", tuple(channel_ids))
+    await conn.commit()
+
+async def add_pooled_temp_vc(channel_id, guild_id):
+    conn = await get_db_connection()
+    await conn.execute("INSERT OR REPLACE INTO temp_vc_pool (channel_id, guild_id) VALUES (?, ?)", (channel_id, guild_id))
+    await conn.commit()
+
+async def remove_pooled_temp_vc(channel_id):
+    conn = await get_db_connection()
+    await conn.execute("DELETE FROM temp_vc_pool WHERE channel_id = ?", (channel_id,))
+    await conn.commit()
+
+async def claim_pooled_temp_vc(channel_id, owner_id):
+    """Moves a pre-created channel out of the pool and registers it as a temp VC."""
+    conn = await get_db_connection()
+    await conn.execute("DELETE FROM temp_vc_pool WHERE channel_id = ?", (channel_id,))
+    await conn.execute("INSERT OR REPLACE INTO temporary_vcs (channel_id, owner_id) VALUES (?, ?)", (channel_id, owner_id))
+    await conn.commit()
+
+async def get_temp_vc_pool():
+    """Returns {guild_id: [channel_id, ...]} for every pre-created pool channel."""
+    conn = await get_db_connection()
+    pool = defaultdict(list)
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT guild_id, channel_id FROM temp_vc_pool ORDER BY channel_id")
+        for guild_id, channel_id in await cursor.fetchall():
+            pool[guild_id].append(channel_id)
+    return dict(pool)
+
 async def get_temp_vc_owner(channel_id):
     conn = await get_db_connection()
     async with conn.cursor() as cursor:
@@ -208,6 +537,14 @@ async def get_temp_vc_text_channel_id(channel_id):
 async def update_temp_vc_owner(channel_id, new_owner_id):
     conn = await get_db_connection()
     await conn.execute("UPDATE temporary_vcs SET owner_id = ? WHERE channel_id = ?", (new_owner_id, channel_id))
+    await conn.commit()
+
+async def get_all_temp_vcs():
+    """Returns {channel_id: owner_id} for every tracked temporary VC."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT channel_id, owner_id FROM temporary_vcs")
+        return {channel_id: owner_id for channel_id, owner_id in await cursor.fetchall()}
 
 # --- SUBMISSION FUNCTIONS ---
 async def add_submission(guild_id, user_id, track_url, submission_type='regular'):
@@ -232,6 +569,13 @@ async def get_submission_queue_count(guild_id, submission_type='regular', status
         result = await cursor.fetchone()
         return result[0] if result else 0
 
+async def get_submission_queue_summary(guild_id):
+    """Returns {(submission_type, status): count} for all queued and in-review submissions."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT submission_type, status, COUNT(*) FROM music_submissions WHERE guild_id = ? AND status IN ('pending', 'reviewing') GROUP BY submission_type, status", (guild_id,))
+        return {(submission_type, status): count for submission_type, status, count in await cursor.fetchall()}
+
 async def get_total_reviewed_count(guild_id, submission_type='regular'):
     conn = await get_db_connection()
     async with conn.cursor() as cursor:
@@ -274,22 +618,38 @@ async def get_koth_leaderboard(guild_id):
         await cursor.execute("SELECT user_id, points, wins, losses, streak FROM koth_leaderboard WHERE guild_id = ? ORDER BY points DESC", (guild_id,))
         return await cursor.fetchall()
 
+async def get_koth_leaderboard_page(guild_id, limit=50, after_points=None, after_user_id=None):
+    """Keyset-paginated KOTH leaderboard, ordered by points then user ID."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        if after_points is None:
+            await cursor.execute("SELECT user_id, points, wins, losses, streak FROM koth_leaderboard WHERE guild_id = ? ORDER BY points DESC, user_id ASC LIMIT ?", (guild_id, limit))
+        else:
+            await cursor.execute(
+                "SELECT user_id, points, wins, losses, streak FROM koth_leaderboard WHERE guild_id = ? AND points <= ? AND (points < ? OR user_id > ?) ORDER BY points DESC, user_id ASC LIMIT ?",
+                (guild_id, after_points, after_points, after_user_id or 0, limit)
+            )
+        return await cursor.fetchall()
+
 async def update_koth_battle_results(guild_id, winner_id, loser_id):
     conn = await get_db_connection()
     await conn.execute("INSERT INTO koth_leaderboard (guild_id, user_id, points, wins, losses, streak) VALUES (?, ?, 1, 1, 0, 1) ON CONFLICT(guild_id, user_id) DO UPDATE SET points = points + 1, wins = wins + 1, streak = streak + 1", (guild_id, winner_id))
     await conn.execute("INSERT INTO koth_leaderboard (guild_id, user_id, points, wins, losses, streak) VALUES (?, ?, 0, 0, 1, 0) ON CONFLICT(guild_id, user_id) DO UPDATE SET losses = losses + 1, streak = 0", (guild_id, loser_id))
     await conn.commit()
+    bump_leaderboard_version(guild_id, 'koth')
 
 async def reset_koth_leaderboard(guild_id):
     conn = await get_db_connection()
     await conn.execute("DELETE FROM koth_leaderboard WHERE guild_id = ?", (guild_id,))
     await conn.commit()
+    bump_leaderboard_version(guild_id, 'koth')
 
 # --- BAD WORD FILTER FUNCTIONS ---
 async def add_bad_word(guild_id, word):
     conn = await get_db_connection()
     await conn.execute("INSERT INTO bad_words (guild_id, word) VALUES (?, ?)", (guild_id, word.lower()))
     await conn.commit()
+    emit(EVENT_BAD_WORDS_CHANGED, guild_id=guild_id)
     return True
 
 async def remove_bad_word(guild_id, word):
@@ -297,7 +657,10 @@ async def remove_bad_word(guild_id, word):
     async with conn.cursor() as cursor:
         await cursor.execute("DELETE FROM bad_words WHERE guild_id = ? AND word = ?", (guild_id, word.lower()))
         await conn.commit()
-        return cursor.rowcount > 0
+        removed = cursor.rowcount > 0
+    if removed:
+        emit(EVENT_BAD_WORDS_CHANGED, guild_id=guild_id)
+    return removed
 
 async def get_bad_words(guild_id):
     conn = await get_db_connection()
@@ -319,6 +682,7 @@ async def update_user_xp(guild_id, user_id, xp_to_add):
     conn = await get_db_connection()
     await conn.execute("INSERT INTO ranking (guild_id, user_id, xp) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET xp = xp + excluded.xp", (guild_id, user_id, xp_to_add))
     await conn.commit()
+    bump_leaderboard_version(guild_id, 'xp')
 
 async def get_user_rank(guild_id, user_id):
     conn = await get_db_connection()
@@ -338,16 +702,41 @@ async def get_leaderboard(guild_id, limit=10):
         await cursor.execute("SELECT user_id, xp FROM ranking WHERE guild_id = ? ORDER BY xp DESC LIMIT ?", (guild_id, limit))
         return await cursor.fetchall()
 
+async def get_leaderboard_page(guild_id, limit=50, after_xp=None, after_user_id=None):
+    """Keyset-paginated XP leaderboard, ordered by XP then user ID."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        if after_xp is None:
+            await cursor.execute("SELECT user_id, xp FROM ranking WHERE guild_id = ? ORDER BY xp DESC, user_id ASC LIMIT ?", (guild_id, limit))
+        else:
+            await cursor.execute(
+                "SELECT user_id, xp FROM ranking WHERE guild_id = ? AND xp <= ? AND (xp < ? OR user_id > ?) ORDER BY xp DESC, user_id ASC LIMIT ?",
+                (guild_id, after_xp, after_xp, after_user_id or 0, limit)
+            )
+        return await cursor.fetchall()
+
 # --- OAUTH & GMAIL VERIFICATION FUNCTIONS ---
 async def create_verification_link(state, guild_id, user_id, server_name, bot_avatar_url):
     conn = await get_db_connection()
-    await conn.execute("INSERT INTO verification_links (state, guild_id, user_id, server_name, bot_avatar_url) VALUES (?, ?, ?, ?, ?)", (state, guild_id, user_id, server_name, bot_avatar_url))
+    ttl = f"+{config.BOT_CONFIG['VERIFICATION_LINK_TTL_MINUTES']} minutes"
+    await conn.execute("INSERT INTO verification_links (state, guild_id, user_id, server_name, bot_avatar_url, created_at, expires_at) VALUES (?, ?, ?, ?, ?, datetime('now'), datetime('now', ?))", (state, guild_id, user_id, server_name, bot_avatar_url, ttl))
     await conn.commit()
 
 async def complete_verification(state, account_name):
+    """Marks a pending OAuth link as verified and publishes it to `verification_completions`.
+    The link's expiry moves out to VERIFIED_LINK_TTL_HOURS so the sweeper doesn't drop a
+    completed verification that is still waiting for its role grant."""
     conn = await get_db_connection()
-    await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ?", (account_name, state))
+    ttl = f"+{config.BOT_CONFIG['VERIFIED_LINK_TTL_HOURS']} hours"
+    async with conn.cursor() as cursor:
+        await cursor.execute("UPDATE verification_links SET status = 'verified', verified_account = ?, expires_at = datetime('now', ?) WHERE state = ? AND status = 'pending'", (account_name, ttl, state))
+        updated = cursor.rowcount > 0
+        await cursor.execute("SELECT guild_id, user_id FROM verification_links WHERE state = ?", (state,))
+        row = await cursor.fetchone()
     await conn.commit()
+    if updated and row:
+        verification_completions.put_nowait((state, row[0], row[1]))
+    return updated
 
 async def get_completed_verifications():
     conn = await get_db_connection()
@@ -360,23 +749,58 @@ async def delete_verification_link(state):
     await conn.execute("DELETE FROM verification_links WHERE state = ?", (state,))
     await conn.commit()
 
+async def delete_verification_links(states):
+    if not states: return
+    conn = await get_db_connection()
+    placeholders = ",".join("?" * len(states))
+    await conn.execute(f"DELETE FROM verification_links WHERE state IN ({placeholders})", tuple(states))
+    await conn.commit()
+
 async def store_gmail_code(guild_id, user_id, code):
     conn = await get_db_connection()
-    await conn.execute("INSERT INTO gmail_verification (guild_id, user_id, verification_code) VALUES (?, ?, ?) ON CONFLICT(guild_id, user_id) DO UPDATE SET verification_code = excluded.verification_code, created_at = CURRENT_TIMESTAMP", (guild_id, user_id, code))
+    ttl = f"+{config.BOT_CONFIG['GMAIL_CODE_TTL_MINUTES']} minutes"
+    await conn.execute("INSERT INTO gmail_verification (guild_id, user_id, verification_code, expires_at) VALUES (?, ?, ?, datetime('now', ?)) ON CONFLICT(guild_id, user_id) DO UPDATE SET verification_code = excluded.verification_code, created_at = CURRENT_TIMESTAMP, expires_at = excluded.expires_at", (guild_id, user_id, code, ttl))
     await conn.commit()
 
 async def get_gmail_code(guild_id, user_id):
     conn = await get_db_connection()
     async with conn.cursor() as cursor:
-        await cursor.execute("SELECT verification_code FROM gmail_verification WHERE guild_id = ? AND user_id = ? AND created_at > datetime('now', '-10 minutes')", (guild_id, user_id))
+        await cursor.execute("SELECT verification_code FROM gmail_verification WHERE guild_id = ? AND user_id = ? AND expires_at > datetime('now')", (guild_id, user_id))
         result = await cursor.fetchone()
         return result[0] if result else None
 
+async def get_pending_gmail_codes(user_id):
+    """Returns (guild_id, code) for every unexpired Gmail code a user has, across all guilds."""
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute("SELECT guild_id, verification_code FROM gmail_verification WHERE user_id = ? AND expires_at > datetime('now')", (user_id,))
+        return await cursor.fetchall()
+
 async def delete_gmail_code(guild_id, user_id):
     conn = await get_db_connection()
     await conn.execute("DELETE FROM gmail_verification WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
     await conn.commit()
 
+# --- EXPIRING ROW MAINTENANCE ---
+EXPIRING_TABLES = ("verification_links", "gmail_verification")
+
+async def delete_expired_rows(table, batch_size=500):
+    """Deletes up to `batch_size` expired rows from one of EXPIRING_TABLES and returns how many went."""
+    if table not in EXPIRING_TABLES: raise ValueError(f"{table} has no expiry column.")
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE expires_at <= datetime('now') LIMIT ?)", (batch_size,))
+        deleted = cursor.rowcount
+    await conn.commit()
+    return deleted
+
+async def get_table_row_count(table):
+    conn = await get_db_connection()
+    async with conn.cursor() as cursor:
+        await cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        result = await cursor.fetchone()
+        return result[0] if result else 0
+
 async def adjust_koth_points(guild_id, user_id, points_to_add):
     """Manually adds or removes points from a user's KOTH score."""
     conn = await get_db_connection()
@@ -389,6 +813,7 @@ async def adjust_koth_points(guild_id, user_id, points_to_add):
         (guild_id, user_id, points_to_add)
     )
     await conn.commit()
+    bump_leaderboard_version(guild_id, 'koth')
     log.info(f"Adjusted KOTH points for user {user_id} in guild {guild_id} by {points_to_add}.")
 
 # --- CUSTOM ROLE SHOP FUNCTIONS ---
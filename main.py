@@ -8,19 +8,26 @@ import asyncio
 # --- Bot Components ---
 import database
 import config
+from scheduler import Scheduler
 from web_server import app
 from cogs.verification import VerificationButton
 from cogs.reporting import ReportTriggerView
 
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
+# Optional: without SHARD_COUNT Discord's recommended count is used. Every shard runs in
+# this one process. Splitting shards across processes (SHARD_IDS) isn't supported: the web
+# server, widget pushes, leaderboard caches, backups and verification hand-off all look
+# guilds up in this process's cache, and there is no cross-process routing yet.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
 
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)-8s] %(name)-12s: %(message)s", datefmt="%Y-m-d %H:%M:%S")
 log = logging.getLogger(__name__)
 
-class MyBot(commands.Bot):
-    def __init__(self, *, intents: discord.Intents):
-        super().__init__(command_prefix="!", intents=intents)
+class MyBot(commands.AutoShardedBot):
+    def __init__(self, *, intents: discord.Intents, shard_count: int = None):
+        # Debug events give us on_socket_raw_receive, used for per-shard event rates.
+        super().__init__(command_prefix="!", intents=intents, shard_count=shard_count, enable_debug_events=True)
 
     async def setup_hook(self):
 
@@ -31,6 +38,11 @@ class MyBot(commands.Bot):
         log.info(f"Started background web server task on port {port}.")
         
         await database.initialize_database()
+
+        # Started before the cogs load so they can register handlers and see persisted jobs;
+        # nothing runs until the bot is ready.
+        self.scheduler = Scheduler(wait_until_ready=self.wait_until_ready)
+        await self.scheduler.start()
         
         self.add_view(ReportTriggerView(bot=self))
         self.add_view(VerificationButton(bot=self))
@@ -52,9 +64,20 @@ class MyBot(commands.Bot):
         log.info("Syncing application commands...")
         synced = await self.tree.sync()
         log.info(f"Synced {len(synced)} commands globally.")
+
+    async def close(self):
+        if hasattr(self, "scheduler"):
+            self.scheduler.stop()
+        await super().close()
         
+    async def on_shard_ready(self, shard_id: int):
+        log.info(f"Shard {shard_id} is ready.")
+
+    async def on_shard_disconnect(self, shard_id: int):
+        log.warning(f"Shard {shard_id} disconnected.")
+
     async def on_ready(self):
-        log.info(f"Logged in as {self.user} (ID: {self.user.id})")
+        log.info(f"Logged in as {self.user} (ID: {self.user.id}) on shards {sorted(self.shards)} of {self.shard_count}")
         log.info("Bot is ready! 🚀")
         activity = discord.Activity(name=config.BOT_CONFIG["ACTIVITY_NAME"], type=discord.ActivityType.watching)
         await self.change_presence(activity=activity)
@@ -66,5 +89,7 @@ if __name__ == "__main__":
     intents.message_content = True
     intents.voice_states = True
     
-    bot = MyBot(intents=intents)
+    if os.getenv("SHARD_IDS"):
+        raise SystemExit("SHARD_IDS is not supported: run every shard in one process (set only SHARD_COUNT).")
+    bot = MyBot(intents=intents, shard_count=SHARD_COUNT)
     bot.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""Lightweight in-process metrics.
+
+Counters, gauges and timings live in plain dicts so any cog can record them
+without extra dependencies. The web server exposes a snapshot at /metrics.
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+counters = defaultdict(int)
+gauges = {}
+timings = {}
+
+def incr(name: str, amount: int = 1):
+    counters[name] += amount
+
+def set_gauge(name: str, value):
+    gauges[name] = value
+
+def observe(name: str, seconds: float):
+    """Records one duration sample for `name`."""
+    stats = timings.get(name)
+    if stats is None:
+        stats = timings[name] = {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+    stats["count"] += 1
+    stats["total"] += seconds
+    stats["last"] = seconds
+    stats["max"] = max(stats["max"], seconds)
+
+@contextmanager
+def timer(name: str):
+    """Times the body of a `with` block and records it under `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def snapshot() -> dict:
+    return {
+        "counters": dict(counters),
+        "gauges": dict(gauges),
+        "timings": {name: {**stats, "avg": stats["total"] / stats["count"]} for name, stats in timings.items()},
+    }
@@ -0,0 +1,168 @@
+"""Persistent job scheduler.
+
+Jobs live in the scheduled_jobs table so they survive restarts, and in an
+in-memory heap ordered by run time so the runner only ever sleeps until the
+next due job. Cogs register a handler per job name and schedule jobs with a
+JSON payload; a job is either one-shot or recurring (every `interval` seconds,
+optionally with random jitter). Each job keeps its unjittered slot (base_run_at)
+next to the jittered run time, and recurring jobs step from the slot so jitter
+never accumulates.
+
+Catch-up policy decides what happens to jobs that came due while the bot was
+offline:
+- run_once: run once as soon as the bot is ready (recurring jobs then carry on
+  from the next slot on their original grid, not from the catch-up run).
+- skip: one-shot jobs are dropped; recurring jobs wait for their next slot.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import random
+import time
+
+import database
+import metrics
+
+log = logging.getLogger(__name__)
+
+CATCH_UP_RUN_ONCE = "run_once"
+CATCH_UP_SKIP = "skip"
+MISSING_HANDLER_RETRY_SECONDS = 300 # Jobs whose cog isn't loaded are retried this much later
+
+class Scheduler:
+    def __init__(self, wait_until_ready=None):
+        self.wait_until_ready = wait_until_ready
+        self.handlers = {}
+        self.jobs: dict[int, dict] = {} # job_id -> job row
+        self.keys: dict[str, int] = {} # job_key -> job_id
+        self.heap: list[tuple[float, int]] = [] # (run_at, job_id); stale entries are skipped when popped
+        self.wakeup = asyncio.Event()
+        self.runner = None
+        self.running: set[asyncio.Task] = set()
+
+    def register(self, name: str, handler):
+        """Registers `handler(payload: dict)` as the coroutine run for jobs named `name`."""
+        self.handlers[name] = handler
+
+    async def start(self):
+        """Loads persisted jobs, applies each job's catch-up policy and starts the runner."""
+        now = time.time()
+        for job in await database.get_scheduled_jobs():
+            if job["run_at"] < now:
+                metrics.incr("scheduler.missed")
+                if job["catch_up"] == CATCH_UP_SKIP:
+                    if not job["interval_seconds"]:
+                        await database.delete_scheduled_job(job["job_id"])
+                        continue
+                    self._set_slot(job, self._next_slot(job, now))
+                    await database.update_scheduled_job_run_at(job["job_id"], job["base_run_at"], job["run_at"])
+            self._push(job)
+        log.info(f"Scheduler loaded {len(self.jobs)} jobs.")
+        self.runner = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.runner:
+            self.runner.cancel()
+        for task in self.running:
+            task.cancel()
+
+    def _push(self, job: dict):
+        self.jobs[job["job_id"]] = job
+        if job["job_key"]:
+            self.keys[job["job_key"]] = job["job_id"]
+        heapq.heappush(self.heap, (job["run_at"], job["job_id"]))
+        metrics.set_gauge("scheduler.jobs", len(self.jobs))
+        self.wakeup.set()
+
+    def _next_slot(self, job: dict, now: float) -> float:
+        """The first slot after `now` on the job's interval grid (before jitter)."""
+        interval = job["interval_seconds"]
+        missed = max(0, int((now - job["base_run_at"]) // interval) + 1)
+        return job["base_run_at"] + missed * interval
+
+    def _set_slot(self, job: dict, base_run_at: float):
+        job["base_run_at"] = base_run_at
+        job["run_at"] = base_run_at + random.uniform(0, job["jitter_seconds"] or 0)
+
+    async def schedule(self, name: str, delay: float = 0, payload: dict = None, interval: float = None,
+                       jitter: float = 0, catch_up: str = CATCH_UP_RUN_ONCE, key: str = None, replace: bool = True) -> int:
+        """Schedules `name` to run `delay` seconds from now (plus up to `jitter` seconds).
+        A `key` makes the job unique: with `replace` an existing job with that key is
+        rescheduled, otherwise it is left alone (handy for recurring jobs set up at startup)."""
+        if key in self.keys:
+            if not replace:
+                return self.keys[key]
+            self.jobs.pop(self.keys.pop(key), None) # The database row is replaced by save_scheduled_job
+        job = {
+            "job_key": key, "name": name, "interval_seconds": interval, "jitter_seconds": jitter,
+            "catch_up": catch_up, "payload": payload or {},
+        }
+        self._set_slot(job, time.time() + delay)
+        job["job_id"] = await database.save_scheduled_job(job["job_key"], name, job["base_run_at"], job["run_at"], interval, jitter, catch_up, json.dumps(job["payload"]))
+        self._push(job)
+        return job["job_id"]
+
+    async def cancel(self, job_id: int):
+        job = self.jobs.pop(job_id, None)
+        if job is not None:
+            if job["job_key"]:
+                self.keys.pop(job["job_key"], None)
+            await database.delete_scheduled_job(job_id)
+            metrics.set_gauge("scheduler.jobs", len(self.jobs))
+
+    async def cancel_key(self, key: str):
+        if key in self.keys:
+            await self.cancel(self.keys[key])
+
+    async def _run(self):
+        if self.wait_until_ready:
+            await self.wait_until_ready()
+        while True:
+            self.wakeup.clear()
+            while self.heap:
+                run_at, job_id = self.heap[0]
+                job = self.jobs.get(job_id)
+                if job is None or job["run_at"] != run_at:
+                    heapq.heappop(self.heap) # Cancelled or rescheduled since it was pushed
+                    continue
+                if run_at > time.time():
+                    break
+                heapq.heappop(self.heap)
+                task = asyncio.create_task(self._execute(job))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: dict):
+        name = job["name"]
+        handler = self.handlers.get(name)
+        if handler is None:
+            log.warning(f"No handler registered for scheduled job '{name}'; retrying later.")
+            metrics.incr("scheduler.missing_handler")
+            job["run_at"] = time.time() + MISSING_HANDLER_RETRY_SECONDS # The slot is kept for recurring jobs
+            await database.update_scheduled_job_run_at(job["job_id"], job["base_run_at"], job["run_at"])
+            self._push(job)
+            return
+
+        metrics.observe(f"scheduler.{name}.lateness", max(0.0, time.time() - job["run_at"]))
+        try:
+            with metrics.timer(f"scheduler.{name}"):
+                await handler(job["payload"])
+            metrics.incr(f"scheduler.{name}.runs")
+        except Exception as e:
+            metrics.incr(f"scheduler.{name}.failures")
+            log.error(f"Scheduled job '{name}' ({job['job_id']}) failed: {e}", exc_info=True)
+
+        if self.jobs.get(job["job_id"]) is not job:
+            return # Cancelled or replaced while running
+        if job["interval_seconds"]:
+            self._set_slot(job, self._next_slot(job, time.time()))
+            await database.update_scheduled_job_run_at(job["job_id"], job["base_run_at"], job["run_at"])
+            self._push(job)
+        else:
+            await self.cancel(job["job_id"])
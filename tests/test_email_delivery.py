@@ -0,0 +1,79 @@
+"""Checks the pooled SMTP sessions of the email delivery queue against a local
+aiosmtpd server: messages are delivered, reuse one session, and a session the
+server dropped is replaced without losing the message."""
+import asyncio
+import os
+import socket
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from cogs import verification
+
+class RecordingHandler:
+    def __init__(self):
+        self.deliveries = [] # (client port, recipients, body)
+
+    async def handle_DATA(self, server, session, envelope):
+        self.deliveries.append((session.peer[1], envelope.rcpt_tos, envelope.content.decode()))
+        return "250 OK"
+
+def _accept_any_login(server, session, envelope, mechanism, auth_data):
+    return AuthResult(success=True)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _start_server(handler, port: int) -> Controller:
+    controller = Controller(handler, hostname="127.0.0.1", port=port,
+                            authenticator=_accept_any_login, auth_require_tls=False)
+    controller.start()
+    return controller
+
+async def _wait_for(condition, timeout: float = 3): # Shorter than the first retry backoff
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out waiting for delivery"
+        await asyncio.sleep(0.02)
+
+async def _send_and_reconnect(servers: list, port: int, handler: RecordingHandler):
+    queue = verification.EmailDeliveryQueue(worker_count=1, hostname="127.0.0.1", port=port, use_tls=False)
+    queue.start(bot=None)
+    try:
+        queue.enqueue(1, "first@example.com", "111111")
+        queue.enqueue(2, "second@example.com", "222222")
+        await _wait_for(lambda: len(handler.deliveries) == 2)
+
+        # Drop the session from the server side, then bring the server back on the same port.
+        await asyncio.to_thread(servers.pop().stop)
+        servers.append(await asyncio.to_thread(_start_server, handler, port))
+
+        queue.enqueue(3, "third@example.com", "333333")
+        await _wait_for(lambda: len(handler.deliveries) == 3)
+    finally:
+        queue.stop()
+
+def test_pooled_smtp_session_sends_and_reconnects_after_drop():
+    os.environ.setdefault("GMAIL_ADDRESS", "bot@example.com")
+    os.environ.setdefault("GMAIL_APP_PASSWORD", "app-password")
+    handler = RecordingHandler()
+    port = _free_port()
+    servers = [_start_server(handler, port)]
+    try:
+        asyncio.run(_send_and_reconnect(servers, port, handler))
+    finally:
+        for server in servers:
+            server.stop()
+
+    (first_port, first_rcpt, first_body), (second_port, _, second_body), (third_port, third_rcpt, third_body) = handler.deliveries
+    assert first_rcpt == ["first@example.com"] and "111111" in first_body
+    assert "222222" in second_body
+    assert first_port == second_port # Second message reused the authenticated session
+    assert third_rcpt == ["third@example.com"] and "333333" in third_body
+    assert third_port != first_port # Delivered over a fresh session after the drop
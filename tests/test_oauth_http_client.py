@@ -0,0 +1,176 @@
+"""Drives the real Twitch and YouTube OAuth callbacks against a local mock of the
+providers' token and profile endpoints.
+
+The mock runs on Hypercorn, which records the client port of every request, so
+we can tell whether callbacks share connections through the app's HTTP client.
+Run directly (`python tests/test_oauth_http_client.py`) to also print the
+latency of pooled vs. one-client-per-callback, or through pytest.
+"""
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from quart import Quart, jsonify, request
+
+import database
+import web_server
+
+CALLBACKS = 20 # Per provider
+
+def build_mock_oauth_app(seen: list) -> Quart:
+    mock = Quart("mock_oauth")
+
+    @mock.before_request
+    async def record_connection():
+        seen.append((request.scope["client"][1], request.http_version))
+
+    @mock.route("/twitch/token", methods=["POST"])
+    async def twitch_token():
+        await request.get_data()
+        assert request.args["code"]
+        return jsonify({"access_token": "twitch-token", "token_type": "bearer"})
+
+    @mock.route("/twitch/users")
+    async def twitch_users():
+        assert request.headers["Authorization"] == "Bearer twitch-token"
+        return jsonify({"data": [{"login": "twitch_viewer"}]})
+
+    @mock.route("/google/token", methods=["POST"])
+    async def google_token():
+        form = await request.form
+        assert form["code"]
+        return jsonify({"access_token": "google-token", "token_type": "bearer"})
+
+    @mock.route("/google/userinfo")
+    async def google_userinfo():
+        assert request.headers["Authorization"] == "Bearer google-token"
+        return jsonify({"name": "YouTube Viewer"})
+
+    return mock
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _callback(client, provider: str, state: str):
+    response = await client.get(f"/callback/{provider}?code=abc&state={state}")
+    assert response.status_code == 200, await response.get_data(as_text=True)
+
+async def _run_callbacks(states: list, concurrent: bool = False, providers=("twitch", "youtube")) -> list[float]:
+    """Runs a callback per provider for each state; returns each one's duration."""
+    durations = []
+    async def timed(client, provider, state):
+        start = time.perf_counter()
+        await _callback(client, provider, state)
+        durations.append(time.perf_counter() - start)
+
+    client = web_server.app.test_client()
+    calls = [timed(client, provider, state) for state in states for provider in providers]
+    if concurrent:
+        await asyncio.gather(*calls)
+    else:
+        for call in calls:
+            await call
+    return durations
+
+async def _new_links(prefix: str) -> list[str]:
+    states = [f"{prefix}-{i}" for i in range(CALLBACKS)]
+    for state in states:
+        await database.create_verification_link(state, 1, 2, "Test Server", "")
+    return states
+
+async def run_latency_check() -> dict:
+    seen, results = [], {}
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    endpoints = {
+        "TWITCH_TOKEN_URL": f"{base_url}/twitch/token", "TWITCH_USERS_URL": f"{base_url}/twitch/users",
+        "GOOGLE_TOKEN_URL": f"{base_url}/google/token", "GOOGLE_USERINFO_URL": f"{base_url}/google/userinfo",
+        "TWITCH_CLIENT_ID": "client-id", "YOUTUBE_CLIENT_ID": "client-id",
+    }
+    originals = {name: getattr(web_server, name) for name in endpoints}
+    for name, value in endpoints.items():
+        setattr(web_server, name, value)
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = config.errorlog = None
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(build_mock_oauth_app(seen), config, shutdown_trigger=shutdown.wait))
+
+    cwd = os.getcwd()
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name) # The callbacks read and write verification links in ./bot_database.db
+    database.db_conn = None
+    try:
+        await database.initialize_database()
+        for _ in range(50): # Wait for the listener
+            try:
+                async with httpx.AsyncClient() as probe:
+                    await probe.get(f"{base_url}/google/userinfo", headers={"Authorization": "Bearer google-token"})
+                break
+            except httpx.ConnectError:
+                await asyncio.sleep(0.05)
+        seen.clear()
+
+        # Shared client as configured in production; plain-text HTTP means HTTP/1.1 keep-alive.
+        web_server.app.http_client = web_server.build_http_client()
+        async with web_server.app.http_client:
+            pooled = await _run_callbacks(await _new_links("pooled"))
+        results["pooled_connections"] = len({client_port for client_port, _ in seen})
+        seen.clear()
+
+        # Same client speaking HTTP/2 (prior knowledge, as there is no TLS/ALPN locally).
+        web_server.app.http_client = web_server.build_http_client(http1=False)
+        async with web_server.app.http_client:
+            await _run_callbacks(await _new_links("http2"), concurrent=True)
+        results["http2_connections"] = len({client_port for client_port, _ in seen})
+        results["http2_versions"] = {version for _, version in seen}
+        seen.clear()
+
+        # Baseline: a fresh client (and connection) per callback, as before the shared client.
+        fresh = []
+        for state in await _new_links("fresh"):
+            for provider in ("twitch", "youtube"):
+                web_server.app.http_client = httpx.AsyncClient(timeout=web_server.HTTP_TIMEOUT)
+                async with web_server.app.http_client:
+                    fresh += await _run_callbacks([state], providers=(provider,))
+        results["fresh_connections"] = len({client_port for client_port, _ in seen})
+
+        results["verified_links"] = len(await database.get_completed_verifications())
+        results["pooled_median_ms"] = statistics.median(pooled) * 1000
+        results["fresh_median_ms"] = statistics.median(fresh) * 1000
+        return results
+    finally:
+        if database.db_conn:
+            await database.db_conn.close()
+        database.db_conn = None
+        os.chdir(cwd)
+        workdir.cleanup()
+        for name, value in originals.items():
+            setattr(web_server, name, value)
+        shutdown.set()
+        await server
+
+def test_oauth_callbacks_reuse_connections_and_speak_http2():
+    results = asyncio.run(run_latency_check())
+    assert results["verified_links"] == 3 * CALLBACKS # Every link was completed by its first callback
+    assert results["pooled_connections"] == 1 # Token exchanges and profile lookups share one connection
+    assert results["http2_connections"] == 1 # Concurrent callbacks multiplexed on one connection
+    assert results["http2_versions"] == {"2"}
+    assert results["fresh_connections"] == 2 * CALLBACKS # Baseline really did reconnect per callback
+
+if __name__ == "__main__":
+    for name, value in asyncio.run(run_latency_check()).items():
+        print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
@@ -1,43 +1,100 @@
 import discord
 from discord import app_commands
+import asyncio
+import logging
 import database
+import metrics
+
+log = logging.getLogger(__name__)
+
+# guild_id -> (admin role IDs, mod role IDs). Filled on first use, dropped on permission_roles_changed.
+_permission_roles: dict[int, tuple[frozenset[int], frozenset[int]]] = {}
+
+async def get_permission_roles(guild_id: int) -> tuple[frozenset[int], frozenset[int]]:
+    """Gets the (admin, mod) role ID sets for a guild, loading them with one query on first use."""
+    roles = _permission_roles.get(guild_id)
+    if roles is None:
+        levels = await database.get_permission_roles(guild_id)
+        admin_ids = frozenset(levels.get(database.PERMISSION_LEVEL_ADMIN, ()))
+        mod_ids = frozenset(levels.get(database.PERMISSION_LEVEL_MOD, ()))
+        roles = _permission_roles[guild_id] = (admin_ids, mod_ids)
+    return roles
+
+def invalidate_permission_roles(guild_id: int):
+    _permission_roles.pop(guild_id, None)
+
+database.subscribe(database.EVENT_PERMISSION_ROLES_CHANGED, invalidate_permission_roles)
+database.subscribe(database.EVENT_DATABASE_RESTORED, _permission_roles.clear)
 
 async def get_admin_roles(guild_id: int) -> list[int]:
     """Gets a list of admin role IDs for a guild."""
-    roles_str = await database.get_setting(guild_id, 'admin_role_ids') or ""
-    return [int(role_id) for role_id in roles_str.split(',') if role_id]
+    return list((await get_permission_roles(guild_id))[0])
 
 async def get_mod_roles(guild_id: int) -> list[int]:
     """Gets a list of moderator role IDs for a guild."""
-    roles_str = await database.get_setting(guild_id, 'mod_role_ids') or ""
-    return [int(role_id) for role_id in roles_str.split(',') if role_id]
+    return list((await get_permission_roles(guild_id))[1])
 
 async def has_admin_role(user: discord.Member) -> bool:
     """Checks if a user has an admin role or server admin permissions."""
     if user.guild_permissions.administrator:
         return True
-    user_role_ids = {role.id for role in user.roles}
-    admin_role_ids = await get_admin_roles(user.guild.id)
-    return any(role_id in user_role_ids for role_id in admin_role_ids)
+    admin_ids, _ = await get_permission_roles(user.guild.id)
+    return not admin_ids.isdisjoint(role.id for role in user.roles)
 
 async def has_mod_role(user: discord.Member) -> bool:
     """Checks if a user has a moderator role (or is an admin)."""
-    if await has_admin_role(user):
+    if user.guild_permissions.administrator:
         return True
+    admin_ids, mod_ids = await get_permission_roles(user.guild.id)
     user_role_ids = {role.id for role in user.roles}
-    mod_role_ids = await get_mod_roles(user.guild.id)
-    return any(role_id in user_role_ids for role_id in mod_role_ids)
+    return not admin_ids.isdisjoint(user_role_ids) or not mod_ids.isdisjoint(user_role_ids)
 
 async def get_log_mentions(guild_id: int) -> str:
     """Gets a string of role mentions for logging purposes."""
-    admin_roles_str = await database.get_setting(guild_id, 'admin_role_ids') or ""
-    mod_roles_str = await database.get_setting(guild_id, 'mod_role_ids') or ""
-    admin_ids = {role_id for role_id in admin_roles_str.split(',') if role_id}
-    mod_ids = {role_id for role_id in mod_roles_str.split(',') if role_id}
-    all_role_ids = admin_ids.union(mod_ids)
+    admin_ids, mod_ids = await get_permission_roles(guild_id)
+    all_role_ids = admin_ids | mod_ids
     if not all_role_ids: return ""
     return " ".join([f"<@&{role_id}>" for role_id in all_role_ids])
 
+def is_shard_connected(bot, shard_id: int) -> bool:
+    """Whether the shard's gateway connection is up, i.e. its member and voice caches are live."""
+    if not isinstance(bot, discord.AutoShardedClient):
+        return not bot.is_closed()
+    shard = bot.get_shard(shard_id)
+    return shard is not None and not shard.is_closed()
+
+def guilds_by_shard(bot) -> dict[int, list[discord.Guild]]:
+    """Groups the bot's guilds by shard. Shards whose gateway connection is down are left out,
+    since their member and voice caches are stale."""
+    shards = {}
+    for guild in bot.guilds:
+        shards.setdefault(guild.shard_id, []).append(guild)
+    return {shard_id: guilds for shard_id, guilds in shards.items() if is_shard_connected(bot, shard_id)}
+
+async def run_per_shard(bot, coro_fn):
+    """Runs `coro_fn(shard_id, guilds)` once per connected shard, concurrently, each pass
+    seeing only its own shard's guilds. A slow or failing shard doesn't hold up the others."""
+    shards = guilds_by_shard(bot)
+    results = await asyncio.gather(*(coro_fn(shard_id, guilds) for shard_id, guilds in shards.items()), return_exceptions=True)
+    for shard_id, result in zip(shards, results):
+        if isinstance(result, Exception):
+            log.error(f"Per-shard pass {coro_fn.__qualname__} failed on shard {shard_id}: {result}", exc_info=result)
+
+async def call_with_rate_limit_retry(coro_factory, attempts: int = 3):
+    """Runs `coro_factory()` and, if Discord still reports a rate limit after the
+    library's own handling, waits out the advertised retry-after and tries again."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await coro_factory()
+        except discord.RateLimited as e:
+            if attempt == attempts: raise
+            retry_after = e.retry_after
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt == attempts: raise
+            retry_after = float(e.response.headers.get('Retry-After', 1))
+        metrics.incr("discord.rate_limit_retries")
+        await asyncio.sleep(retry_after)
+
 def is_bot_moderator():
     """A decorator check for if a user is a bot moderator."""
     async def predicate(interaction: discord.Interaction) -> bool:
@@ -1,4 +1,4 @@
-from quart import Quart, request, render_template, abort, websocket
+from quart import Quart, request, render_template, abort, websocket, make_response, Response, jsonify
 import os
 import httpx
 import aiosqlite
@@ -7,9 +7,20 @@ import asyncio
 import logging
 import json
 import secrets
+import gzip
+import hashlib
+import time
+from email.utils import formatdate
 from collections import defaultdict
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 import database
+import config
+import metrics
 from cogs.ranking import get_rank_info 
 
 load_dotenv()
@@ -25,8 +36,21 @@ YOUTUBE_CLIENT_ID = os.getenv("YOUTUBE_CLIENT_ID")
 YOUTUBE_CLIENT_SECRET = os.getenv("YOUTUBE_CLIENT_SECRET")
 DB_FILE = "bot_database.db"
 
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 TWITCH_REDIRECT_URI = f"{APP_BASE_URL}/callback/twitch"
 YOUTUBE_REDIRECT_URI = f"{APP_BASE_URL}/callback/youtube"
+TWITCH_TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+TWITCH_USERS_URL = "https://api.twitch.tv/helix/users"
+GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
+GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+
+# Shared by every OAuth callback so token exchanges and profile lookups reuse
+# warm HTTP/2 connections. Transport retries only cover connection failures,
+# so a token exchange is never sent twice.
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+HTTP_CONNECT_RETRIES = 2
 
 # --- WebSocket Connection Manager ---
 class WebSocketManager:
@@ -56,6 +80,81 @@ class WebSocketManager:
 ws_manager = WebSocketManager()
 app.ws_manager = ws_manager
 
+# --- Rendered Leaderboard Page Cache ---
+class RenderedPageCache:
+    """Keeps the last rendered leaderboard page per (board, guild), tagged with the
+    leaderboard version it was rendered from."""
+    def __init__(self, max_age: int, precompress: bool):
+        self.max_age = max_age
+        self.precompress = precompress
+        self.pages: dict[tuple[str, int], dict] = {}
+        self.locks = defaultdict(asyncio.Lock)
+
+    def get(self, board: str, guild_id: int, version: int):
+        entry = self.pages.get((board, guild_id))
+        if entry and entry['version'] == version and time.monotonic() - entry['rendered_at'] < self.max_age:
+            return entry
+        return None
+
+    def store(self, board: str, guild_id: int, version: int, body: str) -> dict:
+        raw = body.encode('utf-8')
+        etag = hashlib.sha1(raw).hexdigest()
+        previous = self.pages.get((board, guild_id))
+        # Keep the old Last-Modified if re-rendering produced the exact same page.
+        last_modified = previous['last_modified'] if previous and previous['etag'] == etag else formatdate(usegmt=True)
+        variants = {"identity": raw}
+        if self.precompress:
+            variants['gzip'] = gzip.compress(raw, compresslevel=6)
+            if brotli:
+                variants['br'] = brotli.compress(raw)
+        entry = {"version": version, "rendered_at": time.monotonic(), "etag": etag, "last_modified": last_modified, "variants": variants}
+        self.pages[(board, guild_id)] = entry
+        return entry
+
+page_cache = RenderedPageCache(config.BOT_CONFIG["LEADERBOARD_CACHE_SECONDS"], config.BOT_CONFIG["LEADERBOARD_PRECOMPRESS"])
+
+async def serve_cached_page(board: str, guild_id: int, render):
+    """Serves a leaderboard page from the cache, re-rendering it only when the
+    leaderboard has changed, and answers conditional GETs with a 304."""
+    version = database.get_leaderboard_version(guild_id, board)
+    entry = page_cache.get(board, guild_id, version)
+    if not entry:
+        async with page_cache.locks[(board, guild_id)]:
+            entry = page_cache.get(board, guild_id, version)
+            if not entry:
+                entry = page_cache.store(board, guild_id, version, await render())
+
+    if request.if_none_match.contains_weak(entry['etag']):
+        response = Response(status=304)
+    else:
+        encoding = request.accept_encodings.best_match([e for e in ('br', 'gzip') if e in entry['variants']]) or 'identity'
+        response = await make_response(entry['variants'][encoding])
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(entry['etag'])
+    response.headers['Last-Modified'] = entry['last_modified']
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# --- APP LIFECYCLE ---
+def build_http_client(**transport_options) -> httpx.AsyncClient:
+    """The pooled HTTP/2 client used for OAuth calls. `transport_options` override the
+    transport defaults (tests use http1=False to speak HTTP/2 to a plain-text mock)."""
+    transport = httpx.AsyncHTTPTransport(**{"http2": True, "limits": HTTP_LIMITS, "retries": HTTP_CONNECT_RETRIES, **transport_options})
+    return httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
+
+@app.before_serving
+async def open_http_client():
+    app.http_client = build_http_client()
+    log.info("Opened shared HTTP client.")
+
+@app.after_serving
+async def close_http_client():
+    await app.http_client.aclose()
+    log.info("Closed shared HTTP client.")
+
 # --- HELPER FUNCTIONS ---
 async def get_verification_data(state: str):
     try:
@@ -96,6 +195,18 @@ async def get_full_widget_data(guild_id: int) -> dict:
 
     return {"type": "full_update", "regular_data": {"queue": regular_queue, "reviewing": "N/A"}, "koth_data": {"queue": koth_queue, "king": king_name, "leaderboard": koth_leaderboard}}
 
+# Settings shown on the widget; connected widgets get a fresh full update when one changes.
+WIDGET_SETTINGS = ('koth_king_id', 'submission_status')
+
+def push_widget_update(guild_id: int, setting_name: str, value):
+    if setting_name in WIDGET_SETTINGS and ws_manager.active_connections.get(guild_id):
+        return _broadcast_widget_update(guild_id)
+
+async def _broadcast_widget_update(guild_id: int):
+    await ws_manager.broadcast(guild_id, await get_full_widget_data(guild_id))
+
+database.subscribe(database.EVENT_SETTING_CHANGED, push_widget_update)
+
 # --- WEB ROUTES ---
 @app.route('/')
 async def home():
@@ -105,7 +216,10 @@ async def home():
 async def xp_leaderboard(guild_id: int):
     bot = app.bot_instance; guild = bot.get_guild(guild_id)
     if not guild: return await render_template("leaderboard.html", title="Error", guild_name="Unknown Server", users=[])
-    raw_leaderboard = await database.get_leaderboard(guild_id, limit=100)
+    return await serve_cached_page('xp', guild_id, lambda: render_xp_leaderboard(guild))
+
+async def render_xp_leaderboard(guild) -> str:
+    raw_leaderboard = await database.get_leaderboard(guild.id, limit=100)
     user_data_tasks = [fetch_user_data(user_id) for user_id, xp in raw_leaderboard]
     fetched_users = await asyncio.gather(*user_data_tasks)
     users = []
@@ -118,7 +232,10 @@ async def xp_leaderboard(guild_id: int):
 async def koth_leaderboard(guild_id: int):
     bot = app.bot_instance; guild = bot.get_guild(guild_id)
     if not guild: return await render_template("leaderboard.html", title="Error", guild_name="Unknown Server", users=[])
-    raw_leaderboard = await database.get_koth_leaderboard(guild_id)
+    return await serve_cached_page('koth', guild_id, lambda: render_koth_leaderboard(guild))
+
+async def render_koth_leaderboard(guild) -> str:
+    raw_leaderboard = await database.get_koth_leaderboard(guild.id)
     user_data_tasks = [fetch_user_data(user_id) for user_id, points, w, l, s in raw_leaderboard]
     fetched_users = await asyncio.gather(*user_data_tasks)
     users = []
@@ -127,6 +244,101 @@ async def koth_leaderboard(guild_id: int):
         users.append({"name": user_info['name'], "avatar_url": user_info['avatar_url'], "score": points, "details": f"W/L: {wins}/{losses} | Streak: {streak}"})
     return await render_template("leaderboard.html", title=f"KOTH Leaderboard - {guild.name}", guild_name=guild.name, guild_icon_url=guild.icon.url if guild.icon else None, users=users, score_name="Points")
 
+@app.route('/metrics')
+async def metrics_snapshot():
+    if METRICS_TOKEN and not secrets.compare_digest(request.args.get('token', ''), METRICS_TOKEN):
+        return jsonify({"error": "Invalid token."}), 403
+    return jsonify(metrics.snapshot())
+
+# --- JSON API ---
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+XP_API_FIELDS = ("user_id", "xp", "rank_name", "name", "avatar_url")
+KOTH_API_FIELDS = ("user_id", "points", "wins", "losses", "streak", "name", "avatar_url")
+QUEUE_API_FIELDS = ("status", "king_id", "regular_pending", "regular_reviewing", "koth_pending", "koth_reviewing")
+
+def _int_arg(name: str):
+    value = request.args.get(name)
+    if value is None: return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer.")
+
+def _page_limit() -> int:
+    return max(1, min(_int_arg('limit') or API_PAGE_SIZE, API_MAX_PAGE_SIZE))
+
+def _parse_fields(allowed: tuple) -> tuple:
+    """Reads the `fields=` projection, defaulting to every allowed field."""
+    requested = request.args.get('fields')
+    if not requested: return allowed
+    fields = tuple(f.strip() for f in requested.split(',') if f.strip())
+    unknown = [f for f in fields if f not in allowed]
+    if unknown: raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}.")
+    return fields
+
+async def _resolve_profiles(fields: tuple, user_ids: list) -> list[dict]:
+    """Only looks users up when the caller actually asked for names or avatars."""
+    if 'name' not in fields and 'avatar_url' not in fields:
+        return [{} for _ in user_ids]
+    return await asyncio.gather(*[fetch_user_data(user_id) for user_id in user_ids])
+
+@app.route('/api/leaderboard/<int:guild_id>')
+async def api_xp_leaderboard(guild_id: int):
+    if not app.bot_instance.get_guild(guild_id): return jsonify({"error": "Unknown guild."}), 404
+    try:
+        fields, limit = _parse_fields(XP_API_FIELDS), _page_limit()
+        after_xp, after_user_id = _int_arg('after_xp'), _int_arg('after_user_id')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = await database.get_leaderboard_page(guild_id, limit, after_xp, after_user_id)
+    profiles = await _resolve_profiles(fields, [user_id for user_id, xp in rows])
+    items = []
+    for (user_id, xp), profile in zip(rows, profiles):
+        item = {"user_id": str(user_id), "xp": xp, "rank_name": get_rank_info(xp)[0], **profile}
+        items.append({f: item[f] for f in fields})
+    next_page = {"after_xp": rows[-1][1], "after_user_id": str(rows[-1][0])} if len(rows) == limit else None
+    return jsonify({"items": items, "next": next_page})
+
+@app.route('/api/koth/<int:guild_id>')
+async def api_koth_leaderboard(guild_id: int):
+    if not app.bot_instance.get_guild(guild_id): return jsonify({"error": "Unknown guild."}), 404
+    try:
+        fields, limit = _parse_fields(KOTH_API_FIELDS), _page_limit()
+        after_points, after_user_id = _int_arg('after_points'), _int_arg('after_user_id')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = await database.get_koth_leaderboard_page(guild_id, limit, after_points, after_user_id)
+    profiles = await _resolve_profiles(fields, [row[0] for row in rows])
+    items = []
+    for (user_id, points, wins, losses, streak), profile in zip(rows, profiles):
+        item = {"user_id": str(user_id), "points": points, "wins": wins, "losses": losses, "streak": streak, **profile}
+        items.append({f: item[f] for f in fields})
+    next_page = {"after_points": rows[-1][1], "after_user_id": str(rows[-1][0])} if len(rows) == limit else None
+    return jsonify({"items": items, "next": next_page})
+
+@app.route('/api/queue/<int:guild_id>')
+async def api_queue_status(guild_id: int):
+    if not app.bot_instance.get_guild(guild_id): return jsonify({"error": "Unknown guild."}), 404
+    try:
+        fields = _parse_fields(QUEUE_API_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    summary = await database.get_submission_queue_summary(guild_id)
+    king_id = await database.get_setting(guild_id, 'koth_king_id')
+    item = {
+        "status": await database.get_setting(guild_id, 'submission_status') or 'closed',
+        "king_id": str(king_id) if king_id else None,
+        "regular_pending": summary.get(('regular', 'pending'), 0),
+        "regular_reviewing": summary.get(('regular', 'reviewing'), 0),
+        "koth_pending": summary.get(('koth', 'pending'), 0),
+        "koth_reviewing": summary.get(('koth', 'reviewing'), 0),
+    }
+    return jsonify({f: item[f] for f in fields})
+
 @app.route('/widget/<int:guild_id>')
 async def widget_link_page(guild_id: int):
     token = await database.get_or_create_widget_token(guild_id)
@@ -166,23 +378,22 @@ async def websocket_endpoint():
 async def callback_twitch():
     auth_code, state = request.args.get('code'), request.args.get('state')
     if not auth_code or not state: return "Error: Missing authorization code or state.", 400
-    token_url = "https://id.twitch.tv/oauth2/token"
     token_params = {"client_id": TWITCH_CLIENT_ID, "client_secret": TWITCH_CLIENT_SECRET, "code": auth_code, "grant_type": "authorization_code", "redirect_uri": TWITCH_REDIRECT_URI}
-    async with httpx.AsyncClient() as client: response = await client.post(token_url, params=token_params)
-    token_data = response.json()
-    if 'access_token' not in token_data: return "Error: Could not retrieve access token from Twitch.", 400
-    access_token = token_data['access_token']
-    user_url = "https://api.twitch.tv/helix/users"
-    headers = {"Authorization": f"Bearer {access_token}", "Client-Id": TWITCH_CLIENT_ID}
-    async with httpx.AsyncClient() as client: user_response = await client.get(user_url, headers=headers)
-    user_data = user_response.json()
+    try:
+        response = await app.http_client.post(TWITCH_TOKEN_URL, params=token_params)
+        token_data = response.json()
+        if 'access_token' not in token_data: return "Error: Could not retrieve access token from Twitch.", 400
+        access_token = token_data['access_token']
+        headers = {"Authorization": f"Bearer {access_token}", "Client-Id": TWITCH_CLIENT_ID}
+        user_response = await app.http_client.get(TWITCH_USERS_URL, headers=headers)
+        user_data = user_response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        log.error(f"Twitch OAuth request failed: {e}"); return "Error: Could not reach Twitch. Please try again.", 502
     if not user_data.get('data'): return "Error: Could not retrieve user data from Twitch.", 400
     account_name = user_data['data'][0]['login']
     try:
         template_data = await get_verification_data(state)
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ? AND status = 'pending'", (account_name, state))
-            await conn.commit()
+        await database.complete_verification(state, account_name)
         return await render_template("success.html", account_name=account_name, **template_data)
     except Exception as e:
         print(f"Database error during Twitch callback: {e}"); return "An internal server error occurred.", 500
@@ -191,23 +402,22 @@ async def callback_twitch():
 async def callback_youtube():
     auth_code, state = request.args.get('code'), request.args.get('state')
     if not auth_code or not state: return "Error: Missing authorization code or state.", 400
-    token_url = "https://oauth2.googleapis.com/token"
     token_params = {"client_id": YOUTUBE_CLIENT_ID, "client_secret": YOUTUBE_CLIENT_SECRET, "code": auth_code, "grant_type": "authorization_code", "redirect_uri": YOUTUBE_REDIRECT_URI}
-    async with httpx.AsyncClient() as client: response = await client.post(token_url, data=token_params)
-    token_data = response.json()
-    if 'access_token' not in token_data: return "Error: Could not retrieve access token from Google.", 400
-    access_token = token_data['access_token']
-    user_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client: user_response = await client.get(user_url, headers=headers)
-    user_data = user_response.json()
+    try:
+        response = await app.http_client.post(GOOGLE_TOKEN_URL, data=token_params)
+        token_data = response.json()
+        if 'access_token' not in token_data: return "Error: Could not retrieve access token from Google.", 400
+        access_token = token_data['access_token']
+        headers = {"Authorization": f"Bearer {access_token}"}
+        user_response = await app.http_client.get(GOOGLE_USERINFO_URL, headers=headers)
+        user_data = user_response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        log.error(f"Google OAuth request failed: {e}"); return "Error: Could not reach Google. Please try again.", 502
     if 'name' not in user_data: return "Error: Could not retrieve user data from Google.", 400
     account_name = user_data['name']
     try:
         template_data = await get_verification_data(state)
-        async with aiosqlite.connect(DB_FILE) as conn:
-            await conn.execute("UPDATE verification_links SET status = 'verified', verified_account = ? WHERE state = ? AND status = 'pending'", (account_name, state))
-            await conn.commit()
+        await database.complete_verification(state, account_name)
         return await render_template("success.html", account_name=account_name, **template_data)
     except Exception as e:
         print(f"Database error during YouTube callback: {e}"); return "An internal server error occurred.", 500
\ No newline at end of file